@@ -1,10 +1,15 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, Query, Request, Response, UploadFile, File
+from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import re
 import logging
+import asyncio
 from pathlib import Path
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pydantic import BaseModel, Field
 from typing import List, Optional
 import uuid
@@ -14,6 +19,20 @@ from passlib.context import CryptContext
 from jose import JWTError, jwt
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi import Depends, HTTPException, status
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReturnDocument, UpdateOne, ReplaceOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+import time
+import json
+import calendar
+import socket
+import ipaddress
+import gzip
+import zlib
+import io
+import base64
+from bson import json_util
+import numpy as np
+import pandas as pd
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -59,6 +78,11 @@ class PaymentStatus(str, Enum):
     pending = "en_attente"
     overdue = "en_retard"
 
+class AnalyticsGroupBy(str, Enum):
+    property = "property_id"
+    unit = "unit_id"
+    payment_method = "payment_method"
+
 class Currency(str, Enum):
     EUR = "EUR"
     USD = "USD"
@@ -90,6 +114,7 @@ class User(BaseModel):
     is_active: bool = True
     created_by: str  # ID of admin who created this user
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
 
 class UserCreate(BaseModel):
     username: str
@@ -126,6 +151,7 @@ class Property(BaseModel):
     description: Optional[str] = None
     status: PropertyStatus = PropertyStatus.available
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
 
 class PropertyCreate(BaseModel):
     address: str
@@ -145,6 +171,7 @@ class Unit(BaseModel):
     description: Optional[str] = None
     status: PropertyStatus = PropertyStatus.available
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
 
 class UnitCreate(BaseModel):
     property_id: str
@@ -170,6 +197,7 @@ class Tenant(BaseModel):
     deposit_amount: Optional[float] = None  # Caution
     months_paid: int = 0  # Nombre de mensualités payées
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
 
 class TenantCreate(BaseModel):
     name: str
@@ -197,6 +225,7 @@ class TenantHistory(BaseModel):
     months_paid: int
     action: str  # "moved_in", "moved_out", "rent_updated"
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
 
 class Payment(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -212,6 +241,7 @@ class Payment(BaseModel):
     payment_method: Optional[str] = "Espèces"
     notes: Optional[str] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
 
 class PaymentCreate(BaseModel):
     tenant_id: str
@@ -248,6 +278,28 @@ class Receipt(BaseModel):
     months_paid_total: int  # Nombre total de mois payés par ce locataire
     notes: Optional[str] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+class TenantBalance(BaseModel):
+    tenant_id: str
+    debit: float = 0  # Loyers facturés
+    credit: float = 0  # Loyers encaissés
+    balance: float = 0  # Reste dû
+    months_paid: int = 0
+    entries: int = 0
+    updated_at: Optional[datetime] = None
+
+class LedgerEntry(BaseModel):
+    id: str
+    tenant_id: str
+    payment_id: Optional[str] = None
+    year: Optional[int] = None
+    month: Optional[int] = None
+    reason: str  # created, scheduled, updated, paid, deleted, adjustment, opening_balance
+    debit: float
+    credit: float
+    months_paid: int
+    created_at: datetime
 
 class ReceiptCreate(BaseModel):
     tenant_id: str
@@ -255,6 +307,21 @@ class ReceiptCreate(BaseModel):
     payment_method: Optional[str] = "Espèces"
     notes: Optional[str] = None
 
+class PaymentBulkMarkPaid(BaseModel):
+    payment_ids: List[str]
+    paid_date: Optional[str] = None  # aujourd'hui par défaut
+
+class PaymentScheduleCreate(BaseModel):
+    month: int = Field(ge=1, le=12)
+    year: int
+    due_day: int = Field(default=1, ge=1, le=31)  # ramené au dernier jour si le mois est plus court
+
+class ReceiptBatchCreate(BaseModel):
+    payment_ids: Optional[List[str]] = None  # ou bien month/year : tous les paiements payés du mois
+    month: Optional[int] = None
+    year: Optional[int] = None
+    notes: Optional[str] = None
+
 class DashboardStats(BaseModel):
     total_properties: int
     total_units: int
@@ -274,6 +341,67 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+# bcrypt takes ~250ms of CPU per call, so hashing runs on a small dedicated
+# pool instead of the event loop. Requests beyond PASSWORD_HASH_MAX_PENDING
+# queued jobs are refused rather than piling up, and a single client IP may
+# only have LOGIN_CONCURRENCY_PER_IP logins in flight. Behind the ingress every
+# request comes from a proxy address: the client IP is then taken from
+# X-Forwarded-For, skipping the hops added by TRUSTED_PROXIES (loopback and
+# private networks by default), so that the limit stays per client.
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get("PASSWORD_HASH_MAX_PENDING", "32"))
+LOGIN_CONCURRENCY_PER_IP = int(os.environ.get("LOGIN_CONCURRENCY_PER_IP", "3"))
+TRUSTED_PROXIES = [
+    ipaddress.ip_network(network.strip(), strict=False)
+    for network in os.environ.get(
+        "TRUSTED_PROXIES", "127.0.0.0/8,::1/128,10.0.0.0/8,172.16.0.0/12,192.168.0.0/16,fc00::/7"
+    ).split(",")
+    if network.strip()
+]
+
+def is_trusted_proxy(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXIES)
+
+def client_address(request: Request) -> str:
+    """The peer address, or the last X-Forwarded-For hop not added by a trusted proxy"""
+    address = request.client.host if request.client else "inconnu"
+    if not is_trusted_proxy(address):
+        return address
+    hops = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+    for hop in reversed(hops):
+        address = hop
+        if not is_trusted_proxy(hop):
+            break
+    return address
+
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+password_jobs_pending = 0
+logins_in_flight = {}
+
+async def run_password_job(function, *args):
+    global password_jobs_pending
+    if password_jobs_pending >= PASSWORD_HASH_MAX_PENDING:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Serveur occupé, réessayez dans un instant",
+            headers={"Retry-After": "1"}
+        )
+    password_jobs_pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(password_executor, function, *args)
+    finally:
+        password_jobs_pending -= 1
+
+async def verify_password_async(plain_password, hashed_password):
+    return await run_password_job(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    return await run_password_job(get_password_hash, password)
+
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -281,6 +409,72 @@ def create_access_token(data: dict):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+class UserCache:
+    """In-process LRU of authenticated users, each entry valid for `ttl` seconds.
+
+    Entries are dropped explicitly whenever a user is created, toggled or
+    deleted on this worker, and the whole cache is cleared when another worker
+    changes the users collection (see watch_users). Every invalidation bumps
+    `generation`: a user read from Mongo before an invalidation is not cached
+    after it, so a deactivated account is never served from the cache again.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, username: str) -> Optional[User]:
+        entry = self.entries.get(username)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self.entries[username]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(username)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, username: str, user: User, generation: int):
+        """Cache a user read while the cache was at `generation`"""
+        if generation != self.generation:
+            return
+        self.entries[username] = (time.monotonic() + self.ttl, user)
+        self.entries.move_to_end(username)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, username: str):
+        self.generation += 1
+        if self.entries.pop(username, None) is not None:
+            self.invalidations += 1
+
+    def clear(self):
+        self.generation += 1
+        self.invalidations += len(self.entries)
+        self.entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0
+        }
+
+user_cache = UserCache(
+    ttl=float(os.environ.get("USER_CACHE_TTL_SECONDS", "60")),
+    max_size=int(os.environ.get("USER_CACHE_MAX_SIZE", "1024"))
+)
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -296,10 +490,22 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     except JWTError:
         raise credentials_exception
     
-    user = await db.users.find_one({"username": username})
-    if user is None:
-        raise credentials_exception
-    return User(**user)
+    current_user = user_cache.get(username)
+    if current_user is None:
+        generation = user_cache.generation
+        user = await db.users.find_one({"username": username})
+        if user is None:
+            raise credentials_exception
+        current_user = User(**user)
+        user_cache.set(username, current_user, generation)
+    
+    if not current_user.is_active:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Compte désactivé",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return current_user
 
 async def get_admin_user(current_user: User = Depends(get_current_user)):
     if current_user.role != UserRole.admin:
@@ -327,6 +533,1715 @@ async def create_default_admin():
         await db.users.insert_one(user_dict)
         print("Default admin user created: admin/admin123")
 
+# Pagination
+# List endpoints return documents in creation order, paged on a (created_at, id)
+# keyset: `?after=<cursor>&limit=`. The cursor is opaque (the last document's
+# created_at and id, encoded) and is returned in the X-Next-Cursor header so
+# the response body stays a plain list. The id only breaks ties: ids are
+# random, ordering on them alone would shuffle every list.
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+PAGE_SORT = [("created_at", ASCENDING), ("id", ASCENDING)]
+
+def encode_cursor(document: dict) -> str:
+    created_at = document.get("created_at")
+    key = [created_at.isoformat() if created_at else None, document["id"]]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+def decode_cursor(cursor: str) -> dict:
+    """The filter selecting the documents after this cursor"""
+    try:
+        created_at, document_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        created_at = datetime.fromisoformat(created_at) if created_at else None
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Curseur invalide")
+    if created_at is None:
+        # Documents without created_at sort first
+        return {"$or": [{"created_at": {"$ne": None}}, {"created_at": None, "id": {"$gt": document_id}}]}
+    return {"$or": [
+        {"created_at": {"$gt": created_at}},
+        {"created_at": created_at, "id": {"$gt": document_id}}
+    ]}
+
+async def fetch_page(collection, query: dict, after: Optional[str], limit: int, response: Response, projection: Optional[dict] = None):
+    if after:
+        query = {**query, **decode_cursor(after)}
+    added_key = projection is not None and "created_at" not in projection
+    if added_key:
+        projection = {**projection, "created_at": 1}
+    documents = await collection.find(query, projection).sort(PAGE_SORT).limit(limit + 1).to_list(limit + 1)
+    if len(documents) > limit:
+        documents = documents[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(documents[-1])
+    if added_key:
+        for document in documents:
+            document.pop("created_at", None)
+    return documents
+
+# Field selection
+# `?fields=id,status,amount` on list endpoints: Mongo returns only those fields
+# (plus `id`, which the cursor needs) and they are written out as stored, without
+# building the response_model for every document.
+def field_projection(model, fields: Optional[str]) -> Optional[dict]:
+    if not fields:
+        return None
+    names = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = sorted(names - set(model.model_fields))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Champs inconnus: {', '.join(unknown)}")
+    return {"_id": 0, "id": 1, **{name: 1 for name in names}}
+
+def projected_response(documents, response: Response) -> Response:
+    return Response(
+        content="[" + ",".join(dump_document(document) for document in documents) + "]",
+        media_type="application/json",
+        headers=dict(response.headers)
+    )
+
+# Streaming
+# Large lists can be streamed instead of materialized: `Accept: application/x-ndjson`
+# gives one JSON document per line, `?stream=1` alone gives a JSON array written
+# document by document. The Motor cursor is read in batches of STREAM_BATCH_SIZE,
+# so memory does not grow with the collection.
+STREAM_BATCH_SIZE = 500
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+def _json_default(value):
+    # datetimes as FastAPI would render them; ObjectId, Decimal128... as strings
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+def dump_document(document: dict) -> str:
+    document.pop("_id", None)
+    return json.dumps(document, default=_json_default, ensure_ascii=False)
+
+def wants_ndjson(request: Request) -> bool:
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+def wants_stream(request: Request, stream: bool) -> bool:
+    return stream or wants_ndjson(request)
+
+async def _ndjson_lines(cursor):
+    async for document in cursor:
+        yield dump_document(document) + "\n"
+
+async def _json_array(cursor):
+    separator = "["
+    async for document in cursor:
+        yield separator + dump_document(document)
+        separator = ","
+    yield "[]" if separator == "[" else "]"
+
+def stream_documents(cursor, request: Request) -> StreamingResponse:
+    cursor = cursor.batch_size(STREAM_BATCH_SIZE)
+    if wants_ndjson(request):
+        return StreamingResponse(_ndjson_lines(cursor), media_type=NDJSON_MEDIA_TYPE)
+    return StreamingResponse(_json_array(cursor), media_type="application/json")
+
+# Database indexes
+# Every document is looked up by its string `id`, never by `_id`, so each
+# collection gets a unique index on it. The compound indexes follow the
+# filters and sorts used by the handlers below.
+INDEXES = {
+    "users": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("created_at", ASCENDING), ("id", ASCENDING)]),
+        IndexModel([("username", ASCENDING)], unique=True),
+        IndexModel([("email", ASCENDING)]),
+        IndexModel([("role", ASCENDING)]),
+        IndexModel([("updated_at", ASCENDING)]),
+    ],
+    "settings": [
+        IndexModel([("id", ASCENDING)], unique=True),
+    ],
+    "properties": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("created_at", ASCENDING), ("id", ASCENDING)]),
+        IndexModel([("updated_at", ASCENDING)]),
+    ],
+    "units": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("created_at", ASCENDING), ("id", ASCENDING)]),
+        IndexModel([("property_id", ASCENDING)]),
+        IndexModel([("status", ASCENDING)]),
+        IndexModel([("updated_at", ASCENDING)]),
+    ],
+    "tenants": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("created_at", ASCENDING), ("id", ASCENDING)]),
+        IndexModel([("start_date", ASCENDING), ("end_date", ASCENDING)]),
+        IndexModel([("updated_at", ASCENDING)]),
+    ],
+    "payments": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("created_at", ASCENDING), ("id", ASCENDING)]),
+        IndexModel([("tenant_id", ASCENDING), ("created_at", ASCENDING)]),
+        IndexModel([("year", ASCENDING), ("month", ASCENDING), ("status", ASCENDING)]),
+        IndexModel([("status", ASCENDING), ("due_date", ASCENDING)]),
+        # The generator's upsert filter: all payments of a tenant and month
+        IndexModel([("tenant_id", ASCENDING), ("year", ASCENDING), ("month", ASCENDING)]),
+        # One generated due entry per tenant and month (manual payments are not
+        # constrained). Partial, so it only serves queries with scheduled: true;
+        # the extra key keeps its key pattern distinct from the index above.
+        IndexModel(
+            [("tenant_id", ASCENDING), ("year", ASCENDING), ("month", ASCENDING), ("scheduled", ASCENDING)],
+            unique=True,
+            partialFilterExpression={"scheduled": True}
+        ),
+        IndexModel([("updated_at", ASCENDING)]),
+    ],
+    "receipts": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("created_at", ASCENDING), ("id", ASCENDING)]),
+        IndexModel([("tenant_id", ASCENDING), ("created_at", DESCENDING)]),
+        IndexModel([("created_at", DESCENDING)]),
+        IndexModel([("updated_at", ASCENDING)]),
+        IndexModel([("receipt_number", ASCENDING)], unique=True),
+        IndexModel([("payment_id", ASCENDING)]),
+    ],
+    "tenant_history": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("tenant_id", ASCENDING), ("created_at", DESCENDING)]),
+        IndexModel([("unit_id", ASCENDING), ("start_date", DESCENDING)]),
+        IndexModel([("updated_at", ASCENDING)]),
+    ],
+    "dashboard_stats": [
+        IndexModel([("id", ASCENDING)], unique=True),
+    ],
+    "ledger_entries": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("tenant_id", ASCENDING), ("created_at", DESCENDING)]),
+        IndexModel([("payment_id", ASCENDING)]),
+        IndexModel([("created_at", DESCENDING)]),
+    ],
+    "tenant_balances": [
+        IndexModel([("id", ASCENDING)], unique=True),
+    ],
+    "accounting_periods": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("stale_since", ASCENDING)], sparse=True),
+    ],
+    "monthly_rollups": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("version", ASCENDING), ("scope", ASCENDING)]),
+        IndexModel([("year", ASCENDING), ("month", ASCENDING), ("scope", ASCENDING)]),
+    ],
+    "counters": [
+        IndexModel([("id", ASCENDING)], unique=True),
+    ],
+    "leases": [
+        IndexModel([("id", ASCENDING)], unique=True),
+    ],
+    "deletions": [
+        IndexModel([("deleted_at", ASCENDING)]),
+    ],
+    "backup_runs": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("watermark", DESCENDING)]),
+    ],
+    "occupancy_intervals": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("start", ASCENDING), ("end", ASCENDING)]),
+        IndexModel([("tenant_id", ASCENDING), ("start", DESCENDING)]),
+        IndexModel([("unit_id", ASCENDING), ("start", DESCENDING)]),
+    ],
+}
+
+# Query shapes issued by the handlers: (collection, equality fields, sort/range fields),
+# plus the filter the query always carries when it should use a partial or sparse index.
+# Checked against INDEXES at startup so that a new handler filtering on an
+# unindexed field shows up in the logs instead of as a silent collection scan.
+QUERY_SHAPES = [
+    ("users", ("username",), ()),
+    ("users", ("email",), ()),
+    ("users", ("role",), ()),
+    ("users", (), ("updated_at",)),
+    ("properties", ("id",), ()),
+    ("units", ("id",), ()),
+    ("units", ("property_id",), ()),
+    ("units", ("status",), ()),
+    ("tenants", ("id",), ()),
+    ("tenants", (), ("start_date", "end_date")),
+    ("payments", ("id",), ()),
+    ("payments", ("tenant_id",), ()),
+    ("payments", ("year", "month"), ()),
+    ("payments", (), ("year", "month")),
+    ("payments", ("tenant_id", "year", "month"), ()),
+    ("payments", ("status",), ("due_date",)),
+    ("leases", ("id",), ()),
+    ("receipts", ("id",), ()),
+    ("receipts", (), ("created_at",)),
+    ("receipts", ("tenant_id",), ("created_at",)),
+    ("tenant_history", ("tenant_id",), ("created_at",)),
+    ("tenant_history", ("unit_id",), ("start_date",)),
+    ("dashboard_stats", ("id",), ()),
+    ("settings", ("id",), ()),
+    ("ledger_entries", ("tenant_id",), ("created_at",)),
+    ("ledger_entries", (), ("created_at",)),
+    ("tenant_balances", ("id",), ()),
+    ("accounting_periods", ("id",), ()),
+    ("accounting_periods", ("stale_since",), (), {"stale_since": {"$exists": True}}),
+    ("monthly_rollups", ("version", "scope"), ()),
+    ("monthly_rollups", ("version",), ()),
+    ("monthly_rollups", ("year", "month"), ()),
+    ("counters", ("id",), ()),
+    ("receipts", (), ("receipt_number",)),
+    ("receipts", ("payment_id",), ()),
+    ("properties", (), ("updated_at",)),
+    ("units", (), ("updated_at",)),
+    ("tenants", (), ("updated_at",)),
+    ("payments", (), ("updated_at",)),
+    ("receipts", (), ("updated_at",)),
+    ("tenant_history", (), ("updated_at",)),
+    ("deletions", (), ("deleted_at",)),
+    ("backup_runs", (), ("watermark",)),
+    ("occupancy_intervals", (), ("start", "end")),
+    ("occupancy_intervals", ("tenant_id",), ("start",)),
+    ("users", (), ("created_at", "id")),
+    ("properties", (), ("created_at", "id")),
+    ("units", (), ("created_at", "id")),
+    ("tenants", (), ("created_at", "id")),
+    ("payments", (), ("created_at", "id")),
+    ("receipts", (), ("created_at", "id")),
+]
+
+# Last reconciliation result, exposed through /api/indexes
+index_report = {"status": "pending", "collections": {}, "unindexed_queries": []}
+
+def _index_spec(model: IndexModel):
+    document = model.document
+    return list(document["key"].items()), _index_options(document)
+
+def _index_options(document: dict) -> dict:
+    """The options that change what an index contains, as in IndexModel.document or index_information()"""
+    return {
+        "unique": bool(document.get("unique", False)),
+        "sparse": bool(document.get("sparse", False)),
+        "partialFilterExpression": dict(document.get("partialFilterExpression") or {})
+    }
+
+def _index_covers(index_keys, options, equality_fields, sort_fields, partial_filter=None):
+    """True if the index key prefix serves the equality fields then the sort fields
+
+    A partial or sparse index only holds some documents: it serves a query
+    only when the query carries the same partial filter (for a sparse index,
+    $exists on its fields).
+    """
+    if options["partialFilterExpression"]:
+        if options["partialFilterExpression"] != partial_filter:
+            return False
+    elif options["sparse"]:
+        if not partial_filter or any(partial_filter.get(field) != {"$exists": True} for field, _ in index_keys):
+            return False
+    fields = [field for field, _ in index_keys]
+    if len(fields) < len(equality_fields) + len(sort_fields):
+        return False
+    if set(fields[:len(equality_fields)]) != set(equality_fields):
+        return False
+    return fields[len(equality_fields):len(equality_fields) + len(sort_fields)] == list(sort_fields)
+
+def find_unindexed_queries(built: Optional[dict] = None):
+    """Query shapes no index serves
+
+    `built` maps collection names to their index_information(); without it the
+    declared INDEXES are checked instead.
+    """
+    unindexed = []
+    for collection, equality_fields, sort_fields, *partial_filter in QUERY_SHAPES:
+        partial_filter = partial_filter[0] if partial_filter else None
+        if built is None:
+            indexes = [_index_spec(model) for model in INDEXES.get(collection, [])]
+        else:
+            indexes = [
+                (list(info["key"]), _index_options(info)) for info in built.get(collection, {}).values()
+            ]
+        if not any(
+            _index_covers(keys, options, equality_fields, sort_fields, partial_filter)
+            for keys, options in indexes
+        ):
+            unindexed.append({
+                "collection": collection,
+                "filter": list(equality_fields),
+                "sort": list(sort_fields)
+            })
+    return unindexed
+
+async def ensure_indexes(drop_undeclared: bool = False):
+    """Create missing indexes, rebuild the ones whose definition changed"""
+    total = sum(len(models) for models in INDEXES.values())
+    done = 0
+    index_report["status"] = "building"
+    index_report["collections"] = {}
+
+    for collection_name, models in INDEXES.items():
+        collection = db[collection_name]
+        existing = await collection.index_information()
+        report = {"created": [], "rebuilt": [], "unchanged": [], "dropped": [], "errors": []}
+        declared_names = {"_id_"}
+
+        for model in models:
+            done += 1
+            name = model.document["name"]
+            declared_names.add(name)
+            keys, options = _index_spec(model)
+
+            current = existing.get(name)
+            if current is not None:
+                if list(current["key"]) == keys and _index_options(current) == options:
+                    report["unchanged"].append(name)
+                    continue
+                await collection.drop_index(name)
+
+            started = time.perf_counter()
+            try:
+                await collection.create_indexes([model])
+            except OperationFailure as e:
+                report["errors"].append({"index": name, "error": str(e)})
+                logger.error(f"[index {done}/{total}] {collection_name}.{name} échec: {e}")
+                continue
+
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            report["rebuilt" if current is not None else "created"].append(name)
+            logger.info(f"[index {done}/{total}] {collection_name}.{name} construit en {elapsed_ms:.0f} ms")
+
+        for name in existing:
+            if name in declared_names:
+                continue
+            if drop_undeclared:
+                await collection.drop_index(name)
+                report["dropped"].append(name)
+            else:
+                logger.warning(f"Index non déclaré conservé: {collection_name}.{name}")
+
+        index_report["collections"][collection_name] = report
+
+    # Check against what was actually built: an index that failed is not there
+    built = {}
+    for collection_name in {shape[0] for shape in QUERY_SHAPES}:
+        built[collection_name] = await db[collection_name].index_information()
+    index_report["unindexed_queries"] = find_unindexed_queries(built)
+    for shape in index_report["unindexed_queries"]:
+        logger.warning(
+            f"Requête sans index: {shape['collection']} filtre={shape['filter']} tri={shape['sort']}"
+        )
+    index_report["status"] = "ready"
+    return index_report
+
+# Dashboard counters
+# The dashboard reads materialized counters from `dashboard_stats` instead of
+# scanning collections: one "totals" document for the portfolio and one
+# document per payment month. Every write path adjusts them with $inc, and
+# rebuild_dashboard_stats() recomputes everything if they ever drift.
+DASHBOARD_TOTALS_ID = "totals"
+
+def month_stats_id(year: int, month: int) -> str:
+    return f"payments-{year}-{month:02d}"
+
+async def bump_totals(**deltas):
+    deltas = {field: delta for field, delta in deltas.items() if delta}
+    if deltas:
+        await db.dashboard_stats.update_one(
+            {"id": DASHBOARD_TOTALS_ID},
+            {"$inc": deltas},
+            upsert=True
+        )
+
+async def bump_payment_stats(removed=(), added=()):
+    """Take `removed` payments out of their month counters and add `added` ones"""
+    month_incs = {}
+    for sign, payments in ((-1, removed), (1, added)):
+        for payment in payments:
+            inc = month_incs.setdefault((payment["year"], payment["month"]), {})
+            status_field = f"status_counts.{PaymentStatus(payment['status']).name}"
+            inc[status_field] = inc.get(status_field, 0) + sign
+            if payment["status"] == PaymentStatus.paid:
+                inc["revenue"] = inc.get("revenue", 0) + sign * payment["amount"]
+    if not month_incs:
+        return
+    await invalidate_rollups(month_incs)
+    await db.dashboard_stats.bulk_write([
+        UpdateOne(
+            {"id": month_stats_id(year, month)},
+            {"$inc": inc, "$setOnInsert": {"year": year, "month": month}},
+            upsert=True
+        )
+        for (year, month), inc in month_incs.items()
+    ], ordered=False)
+
+async def _units_summary():
+    result = await db.units.aggregate([
+        {"$group": {
+            "_id": None,
+            "total": {"$sum": 1},
+            "occupied": {"$sum": {"$cond": [{"$eq": ["$status", PropertyStatus.occupied.value]}, 1, 0]}}
+        }}
+    ]).to_list(1)
+    return result[0] if result else {"total": 0, "occupied": 0}
+
+async def _payments_by_month(match: Optional[dict] = None):
+    return await db.payments.aggregate([
+        {"$match": match or {}},
+        {"$group": {
+            "_id": {"year": "$year", "month": "$month", "status": "$status"},
+            "count": {"$sum": 1},
+            "amount": {"$sum": "$amount"}
+        }}
+    ]).to_list(None)
+
+def _month_stats_documents(payment_groups) -> dict:
+    status_names = {payment_status.value: payment_status.name for payment_status in PaymentStatus}
+    months = {}
+    for group in payment_groups:
+        key = group["_id"]
+        if key.get("year") is None or key.get("month") is None or key.get("status") not in status_names:
+            continue
+        doc = months.setdefault((key["year"], key["month"]), {
+            "id": month_stats_id(key["year"], key["month"]),
+            "year": key["year"],
+            "month": key["month"],
+            "revenue": 0,
+            "status_counts": {}
+        })
+        doc["status_counts"][status_names[key["status"]]] = group["count"]
+        if key["status"] == PaymentStatus.paid.value:
+            doc["revenue"] = group["amount"]
+    return months
+
+async def refresh_month_stats(months):
+    """Recompute the counters of the given (year, month) pairs only"""
+    months = set(months)
+    if not months:
+        return
+    await invalidate_rollups(months)
+    groups = await _payments_by_month({"$or": [{"year": year, "month": month} for year, month in months]})
+    documents = _month_stats_documents(groups)
+    await db.dashboard_stats.bulk_write([
+        ReplaceOne(
+            {"id": month_stats_id(year, month)},
+            documents.get((year, month)) or {
+                "id": month_stats_id(year, month),
+                "year": year,
+                "month": month,
+                "revenue": 0,
+                "status_counts": {}
+            },
+            upsert=True
+        )
+        for year, month in months
+    ], ordered=False)
+
+async def rebuild_dashboard_stats():
+    """Recompute every counter from the source collections"""
+    total_properties, total_tenants, units, payment_groups = await asyncio.gather(
+        db.properties.count_documents({}),
+        db.tenants.count_documents({}),
+        _units_summary(),
+        _payments_by_month()
+    )
+    months = _month_stats_documents(payment_groups)
+
+    totals = {
+        "id": DASHBOARD_TOTALS_ID,
+        "properties": total_properties,
+        "units": units["total"],
+        "occupied_units": units["occupied"],
+        "tenants": total_tenants
+    }
+    documents = [totals] + list(months.values())
+    await db.dashboard_stats.bulk_write(
+        [ReplaceOne({"id": doc["id"]}, doc, upsert=True) for doc in documents],
+        ordered=False
+    )
+    await db.dashboard_stats.delete_many({"id": {"$nin": [doc["id"] for doc in documents]}})
+    return {"months": len(months), **{k: v for k, v in totals.items() if k != "id"}}
+
+# Analytics
+# Per-month payment figures grouped by property, unit or payment method. Closed
+# months are read from `monthly_rollups` (below); the open month, and closed
+# months whose rollups are missing or stale, come from one $group over the
+# (year, month, status) index of `payments`.
+ARREARS_BUCKETS = [(30, "0-30"), (60, "31-60"), (90, "61-90")]
+ARREARS_OLDEST_BUCKET = "90+"
+FIGURE_FIELDS = ("payments", "paid_payments", "pending_payments", "overdue_payments", "expected", "collected", "overdue")
+
+def analytics_month_id(year: int, month: int) -> str:
+    return f"{year}-{month:02d}"
+
+def parse_month(value: str):
+    year, month = value.split("-")
+    if not 1 <= int(month) <= 12:
+        raise HTTPException(status_code=400, detail=f"Mois invalide: {value}")
+    return int(year), int(month)
+
+def month_range(start, end):
+    (year, month), months = start, []
+    while (year, month) <= end:
+        months.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+def is_closed_month(year: int, month: int) -> bool:
+    today = datetime.utcnow()
+    return (year, month) < (today.year, today.month)
+
+def months_between(first: datetime, last: datetime, floor: datetime) -> set:
+    """(year, month) pairs from first to last included, within floor and the current month"""
+    today = datetime.utcnow()
+    first = max(first, floor)
+    year, month = first.year, first.month
+    last_key = min((last.year, last.month), (today.year, today.month))
+    months = set()
+    while (year, month) <= last_key:
+        months.add((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+def lease_change_months(before: Optional[dict], after: Optional[dict], floor: datetime) -> set:
+    """Months from `floor` on whose occupancy differs between two versions of a lease interval
+
+    Rollups only hold occupied days per property and unit, so the rent does
+    not matter. Unparseable dates (datetime.min) and open ends are bounded by
+    `floor` and the current month.
+    """
+    if not before or not after:
+        lease = before or after
+        return months_between(lease["start"], lease["end"], floor) if lease else set()
+    if any(before.get(key) != after.get(key) for key in ("property_id", "unit_id")):
+        return months_between(before["start"], before["end"], floor) | months_between(after["start"], after["end"], floor)
+    months = set()
+    for bound in ("start", "end"):
+        if before[bound] != after[bound]:
+            months |= months_between(min(before[bound], after[bound]), max(before[bound], after[bound]), floor)
+    return months
+
+async def earliest_payment_month() -> Optional[datetime]:
+    """First day of the oldest month with payments: no rollup exists before it"""
+    first = await db.payments.find_one(
+        {"year": {"$ne": None}}, {"year": 1, "month": 1}, sort=[("year", ASCENDING), ("month", ASCENDING)]
+    )
+    return datetime(first["year"], first["month"], 1) if first and first.get("month") else None
+
+def payment_figure_accumulators() -> dict:
+    def count_status(payment_status):
+        return {"$sum": {"$cond": [{"$eq": ["$status", payment_status.value]}, 1, 0]}}
+
+    def amount_status(payment_status):
+        return {"$sum": {"$cond": [{"$eq": ["$status", payment_status.value]}, "$amount", 0]}}
+
+    return {
+        "payments": {"$sum": 1},
+        "paid_payments": count_status(PaymentStatus.paid),
+        "pending_payments": count_status(PaymentStatus.pending),
+        "overdue_payments": count_status(PaymentStatus.overdue),
+        "expected": {"$sum": "$amount"},
+        "collected": amount_status(PaymentStatus.paid),
+        "overdue": amount_status(PaymentStatus.overdue)
+    }
+
+def merge_figures(rows) -> list:
+    """Sum rows sharing the same key, sorted by key"""
+    merged = {}
+    for row in rows:
+        target = merged.setdefault(row["key"], {"key": row["key"], **{field: 0 for field in FIGURE_FIELDS}})
+        for field in FIGURE_FIELDS:
+            target[field] += row.get(field, 0)
+    return sorted(merged.values(), key=lambda row: str(row["key"]))
+
+async def _payments_by_group(group_by: AnalyticsGroupBy, months) -> dict:
+    groups = await db.payments.aggregate([
+        {"$match": {"$or": [{"year": year, "month": month} for year, month in months]}},
+        {"$group": {
+            "_id": {"year": "$year", "month": "$month", "key": f"${group_by.value}"},
+            **payment_figure_accumulators()
+        }}
+    ]).to_list(None)
+    rows = {month: [] for month in months}
+    for group in groups:
+        key = group.pop("_id")
+        rows[(key["year"], key["month"])].append({"key": key.get("key"), **group})
+    return {month: merge_figures(month_rows) for month, month_rows in rows.items()}
+
+async def monthly_payment_figures(group_by: AnalyticsGroupBy, start, end) -> dict:
+    """{(year, month): [per-group figures]} for every month from start to end"""
+    months = month_range(start, end)
+    versions = await closed_rollup_versions([month for month in months if is_closed_month(*month)])
+    figures = {}
+    if versions:
+        scope = "unit" if group_by == AnalyticsGroupBy.unit else "property"
+        rollups = await db.monthly_rollups.find({"version": {"$in": list(versions.values())}, "scope": scope}).to_list(None)
+        rows = {month: [] for month in versions}
+        for rollup in rollups:
+            month_rows = rows[(rollup["year"], rollup["month"])]
+            if group_by == AnalyticsGroupBy.payment_method:
+                month_rows.extend(rollup["payment_methods"])
+            elif rollup["payments"]:
+                month_rows.append({"key": rollup[group_by.value], **rollup})
+        figures = {month: merge_figures(month_rows) for month, month_rows in rows.items()}
+
+    missing = [month for month in months if month not in figures]
+    if missing:
+        figures.update(await _payments_by_group(group_by, missing))
+    return {month: figures[month] for month in months}
+
+def analytics_period(start: Optional[str], end: Optional[str]):
+    """Parse ?start=&end= (YYYY-MM), by default the last 12 months"""
+    today = datetime.utcnow()
+    end_month = parse_month(end) if end else (today.year, today.month)
+    if start:
+        start_month = parse_month(start)
+    else:
+        year, month = end_month
+        start_month = (year - 1, month + 1) if month < 12 else (year, 1)
+    if start_month > end_month:
+        raise HTTPException(status_code=400, detail="La période commence après sa fin")
+    return start_month, end_month
+
+# Monthly rollups
+# Closing a month writes one `monthly_rollups` document per property and per
+# unit (unit_id None for payments not tied to a unit): expected rent, collected
+# amount, payment counts by status and occupancy days; property documents also
+# break the payment figures down by payment method. The month's
+# `accounting_periods` document points to the current rollup version. A version
+# is never modified: a late edit to a closed month stamps `stale_since` on its
+# period, reports fall back to raw payments for it, and the month is
+# recomputed under a new version right away (and by the next period-close run
+# if that fails). A version computed before the last stamp is not published.
+PERIOD_CLOSE_INTERVAL_SECONDS = int(os.environ.get("PERIOD_CLOSE_INTERVAL_SECONDS", "3600"))
+ROLLUP_LEASE_SECONDS = 300
+rollup_tasks = set()
+
+async def closed_rollup_versions(months) -> dict:
+    """{(year, month): rollup version} for the given months that have fresh rollups"""
+    if not months:
+        return {}
+    periods = await db.accounting_periods.find({
+        "id": {"$in": [analytics_month_id(*month) for month in months]},
+        "version": {"$exists": True},
+        "stale_since": {"$exists": False}
+    }).to_list(None)
+    return {(period["year"], period["month"]): period["version"] for period in periods}
+
+async def invalidate_rollups(months=None):
+    """Mark the rollups of these (year, month) pairs, or of every month, stale and recompute them"""
+    now = datetime.utcnow()
+    if months is None:
+        await db.accounting_periods.update_many({}, {"$set": {"stale_since": now}})
+    else:
+        months = {month for month in months if is_closed_month(*month)}
+        if not months:
+            return
+        await db.accounting_periods.bulk_write([
+            UpdateOne(
+                {"id": analytics_month_id(year, month)},
+                {"$set": {"year": year, "month": month, "stale_since": now}},
+                upsert=True
+            )
+            for year, month in months
+        ], ordered=False)
+    task = asyncio.create_task(close_periods(months))
+    rollup_tasks.add(task)
+    task.add_done_callback(rollup_tasks.discard)
+
+async def _occupancy_days(year: int, month: int) -> dict:
+    """Occupied days of the month per (property_id, unit_id), overlapping leases counted once per day"""
+    first_day = datetime(year, month, 1)
+    last_day = datetime(year, month, calendar.monthrange(year, month)[1])
+    intervals = await db.occupancy_intervals.find(
+        {"start": {"$lte": last_day}, "end": {"$gte": first_day}},
+        {"_id": 0, "property_id": 1, "unit_id": 1, "start": 1, "end": 1}
+    ).sort("start", ASCENDING).to_list(None)
+    days = {}
+    covered_until = {}
+    for interval in intervals:
+        key = (interval.get("property_id"), interval.get("unit_id"))
+        start, end = max(interval["start"], first_day), min(interval["end"], last_day)
+        # Leases come by start date: only the days after the earlier ones are new
+        if key in covered_until:
+            start = max(start, covered_until[key] + timedelta(days=1))
+        if end >= start:
+            days[key] = days.get(key, 0) + (end - start).days + 1
+        covered_until[key] = max(covered_until.get(key, end), end)
+    return days
+
+async def compute_rollups(year: int, month: int, version: str) -> list:
+    payment_groups, occupancy = await asyncio.gather(
+        db.payments.aggregate([
+            {"$match": {"year": year, "month": month}},
+            {"$group": {
+                "_id": {"property_id": "$property_id", "unit_id": "$unit_id", "payment_method": "$payment_method"},
+                **payment_figure_accumulators()
+            }}
+        ]).to_list(None),
+        _occupancy_days(year, month)
+    )
+    computed_at = datetime.utcnow()
+    documents = {}
+
+    def rollup(scope, property_id, unit_id=None):
+        key = (scope, property_id, unit_id)
+        if key not in documents:
+            documents[key] = {
+                "id": f"{analytics_month_id(year, month)}:{scope}:{property_id}:{unit_id}:{version}",
+                "version": version,
+                "year": year,
+                "month": month,
+                "scope": scope,
+                "property_id": property_id,
+                "unit_id": unit_id,
+                **{field: 0 for field in FIGURE_FIELDS},
+                "occupancy_days": 0,
+                "computed_at": computed_at
+            }
+            if scope == "property":
+                documents[key]["payment_methods"] = []
+        return documents[key]
+
+    for group in payment_groups:
+        key = group.pop("_id")
+        property_doc = rollup("property", key.get("property_id"))
+        unit_doc = rollup("unit", key.get("property_id"), key.get("unit_id"))
+        for field in FIGURE_FIELDS:
+            property_doc[field] += group[field]
+            unit_doc[field] += group[field]
+        property_doc["payment_methods"].append({"key": key.get("payment_method"), **group})
+
+    for (property_id, unit_id), days in occupancy.items():
+        rollup("unit", property_id, unit_id)["occupancy_days"] += days
+        rollup("property", property_id)["occupancy_days"] += days
+
+    for document in documents.values():
+        if document["scope"] == "property":
+            document["payment_methods"] = merge_figures(document["payment_methods"])
+    return list(documents.values())
+
+async def close_period(year: int, month: int) -> Optional[int]:
+    """Write a new rollup version for a closed month; the number of rollups, or None if not published"""
+    period_id = analytics_month_id(year, month)
+    lease_id = f"period-close-{period_id}"
+    if not await acquire_lease(lease_id, ROLLUP_LEASE_SECONDS):
+        return None
+    try:
+        started = datetime.utcnow()
+        version = uuid.uuid4().hex
+        documents = await compute_rollups(year, month, version)
+        if documents:
+            await db.monthly_rollups.insert_many(documents, ordered=False)
+        try:
+            published = await db.accounting_periods.find_one_and_update(
+                {"id": period_id, "$or": [{"stale_since": {"$exists": False}}, {"stale_since": {"$lt": started}}]},
+                {
+                    "$set": {"year": year, "month": month, "version": version, "closed_at": datetime.utcnow(), "rollups": len(documents)},
+                    "$unset": {"stale_since": ""}
+                },
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # Edited again while computing: this version is already out of date
+            await db.monthly_rollups.delete_many({"version": version})
+            return None
+        # The previous version stays until the next close, for reports that
+        # read the period just before it was republished
+        current = [version] + ([published["version"]] if published and published.get("version") else [])
+        await db.monthly_rollups.delete_many({"year": year, "month": month, "version": {"$nin": current}})
+        return len(documents)
+    finally:
+        await db.leases.delete_one({"id": lease_id, "holder": WORKER_ID})
+
+async def close_periods(months=None) -> dict:
+    """Close the given months, or every past month without fresh rollups"""
+    if months is None:
+        payment_months = await db.payments.aggregate([
+            {"$group": {"_id": {"year": "$year", "month": "$month"}}}
+        ]).to_list(None)
+        months = {
+            (group["_id"]["year"], group["_id"]["month"]) for group in payment_months
+            if group["_id"].get("year") and group["_id"].get("month")
+        }
+        stale = await db.accounting_periods.find({"stale_since": {"$exists": True}}).to_list(None)
+        months |= {(period["year"], period["month"]) for period in stale}
+        months = {month for month in months if is_closed_month(*month)}
+        months -= set(await closed_rollup_versions(list(months)))
+
+    result = {"closed": 0, "skipped": 0, "rollups": 0}
+    for year, month in sorted(months):
+        try:
+            count = await close_period(year, month)
+        except Exception as e:
+            logger.error(f"Échec de la clôture de {analytics_month_id(year, month)}: {e}")
+            count = None
+        if count is None:
+            result["skipped"] += 1
+        else:
+            result["closed"] += 1
+            result["rollups"] += count
+    return result
+
+# Reports
+# Owner statements are computed with pandas: payments, tenants, units and
+# occupancy intervals are read through projected cursors, REPORT_BATCH_SIZE
+# documents at a time, into DataFrames. Each payment batch is reduced to one
+# row per tenant right away, so memory depends on the batch size and the
+# number of tenants, not on the number of payments.
+REPORT_BATCH_SIZE = int(os.environ.get("REPORT_BATCH_SIZE", "50000"))
+REPORT_FORMATS = {
+    "csv": "text/csv",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "parquet": "application/vnd.apache.parquet",
+}
+PAYMENT_TOTAL_COLUMNS = ["payments", "billed", "paid", "arrears", "arrears_payments"]
+
+async def report_frames(cursor, columns):
+    """DataFrames of at most REPORT_BATCH_SIZE documents from a projected cursor"""
+    batch = []
+    async for document in cursor:
+        batch.append(document)
+        if len(batch) >= REPORT_BATCH_SIZE:
+            yield pd.DataFrame.from_records(batch, columns=columns)
+            batch = []
+    if batch:
+        yield pd.DataFrame.from_records(batch, columns=columns)
+
+async def report_frame(cursor, columns) -> pd.DataFrame:
+    frames = [frame async for frame in report_frames(cursor, columns)]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+
+def payment_totals(payments: pd.DataFrame, today: str) -> pd.DataFrame:
+    """Billed, paid and arrears per tenant for one batch of payments"""
+    amount = payments["amount"].fillna(0).astype(float)
+    paid = (payments["status"] == PaymentStatus.paid.value).to_numpy()
+    # Payments without a due date are never counted as arrears
+    past_due = (payments["due_date"].fillna("9999-12-31") < today).to_numpy() & ~paid
+    frame = pd.DataFrame({
+        "tenant_id": payments["tenant_id"],
+        "payments": 1,
+        "billed": amount,
+        "paid": np.where(paid, amount, 0.0),
+        "arrears": np.where(past_due, amount, 0.0),
+        "arrears_payments": past_due.astype(int),
+        "oldest_arrear": payments["due_date"].where(past_due),
+    })
+    return merge_payment_totals(frame)
+
+def merge_payment_totals(frame: pd.DataFrame) -> pd.DataFrame:
+    return frame.groupby("tenant_id", dropna=False).agg(
+        {**{column: "sum" for column in PAYMENT_TOTAL_COLUMNS}, "oldest_arrear": "min"}
+    )
+
+def occupancy_days(intervals: pd.DataFrame, by: str) -> pd.Series:
+    """Days occupied during the period per `by`: overlapping leases are merged, so each day counts once"""
+    if intervals.empty:
+        return pd.Series(dtype=float)
+    ordered = intervals.sort_values([by, "start"])
+    # A lease starting after every earlier lease of its group has ended opens a new run
+    reach = ordered.groupby(by)["end"].cummax().groupby(ordered[by]).shift()
+    run = (reach.isna() | (ordered["start"] > reach)).cumsum()
+    runs = ordered.groupby([ordered[by], run]).agg(start=("start", "min"), end=("end", "max"))
+    days = (runs["end"] - runs["start"]).dt.days + 1
+    return days.groupby(level=0).sum()
+
+async def build_portfolio_report(start, end):
+    """(per-tenant DataFrame, per-property DataFrame) for the months from start to end"""
+    period_start = datetime(*start, 1)
+    period_end = datetime(end[0], end[1], calendar.monthrange(*end)[1])
+    period_days = (period_end - period_start).days + 1
+    today = datetime.utcnow().strftime("%Y-%m-%d")
+
+    # Payments: one reduced frame per batch, merged as we go
+    totals = None
+    payments = db.payments.find(
+        {"$or": [{"year": year, "month": month} for year, month in month_range(start, end)]},
+        {"_id": 0, "tenant_id": 1, "amount": 1, "status": 1, "due_date": 1}
+    ).batch_size(REPORT_BATCH_SIZE)
+    async for batch in report_frames(payments, ["tenant_id", "amount", "status", "due_date"]):
+        batch_totals = payment_totals(batch, today)
+        totals = batch_totals if totals is None else merge_payment_totals(
+            pd.concat([totals, batch_totals]).reset_index()
+        )
+
+    # Leases clipped to the period by Mongo, so every bound is a real date
+    intervals, tenants, units, properties = await asyncio.gather(
+        report_frame(db.occupancy_intervals.aggregate([
+            {"$match": {"start": {"$lte": period_end}, "end": {"$gte": period_start}}},
+            {"$project": {
+                "_id": 0, "tenant_id": 1, "property_id": 1, "unit_id": 1,
+                "start": {"$max": ["$start", period_start]},
+                "end": {"$min": ["$end", period_end]}
+            }}
+        ], batchSize=REPORT_BATCH_SIZE), ["tenant_id", "property_id", "unit_id", "start", "end"]),
+        report_frame(
+            db.tenants.find({}, {"_id": 0, "id": 1, "name": 1, "phone": 1, "property_id": 1, "unit_id": 1, "monthly_rent": 1}),
+            ["id", "name", "phone", "property_id", "unit_id", "monthly_rent"]
+        ),
+        report_frame(db.units.find({}, {"_id": 0, "id": 1, "property_id": 1, "unit_number": 1}), ["id", "property_id", "unit_number"]),
+        report_frame(db.properties.find({}, {"_id": 0, "id": 1, "address": 1}), ["id", "address"])
+    )
+    intervals["start"] = pd.to_datetime(intervals["start"])
+    intervals["end"] = pd.to_datetime(intervals["end"])
+
+    # Per tenant
+    report = tenants.rename(columns={"id": "tenant_id", "name": "tenant_name"}).set_index("tenant_id")
+    if totals is None:
+        totals = pd.DataFrame(columns=PAYMENT_TOTAL_COLUMNS + ["oldest_arrear"])
+    report = report.join(totals, how="left")
+    report[PAYMENT_TOTAL_COLUMNS] = report[PAYMENT_TOTAL_COLUMNS].fillna(0)
+    report[["payments", "arrears_payments"]] = report[["payments", "arrears_payments"]].astype(int)
+    report["balance"] = report["billed"] - report["paid"]
+    report["occupancy_days"] = occupancy_days(intervals, "tenant_id").reindex(report.index).fillna(0)
+    report["occupancy_ratio"] = (report["occupancy_days"] / period_days).round(4)
+    report = report.join(properties.set_index("id")["address"].rename("property_address"), on="property_id")
+    report = report.join(units.set_index("id")["unit_number"], on="unit_id")
+    report = report.reset_index()[[
+        "tenant_id", "tenant_name", "phone", "property_id", "property_address", "unit_id", "unit_number",
+        "monthly_rent", "payments", "billed", "paid", "balance", "arrears", "arrears_payments",
+        "oldest_arrear", "occupancy_days", "occupancy_ratio"
+    ]]
+
+    # Per property: occupied days over units x days. A lease on the property
+    # itself (no unit) fills one more slot of its own, and a property without
+    # units counts as one slot
+    unit_intervals = intervals[intervals["unit_id"].notna()]
+    property_intervals = intervals[intervals["unit_id"].isna()]
+    unit_days = occupancy_days(unit_intervals, "unit_id")
+    property_days = occupancy_days(property_intervals, "property_id")
+    occupied = units.assign(days=units["id"].map(unit_days).fillna(0)).groupby("property_id")["days"].sum()
+    occupied = occupied.add(property_days, fill_value=0)
+    slots = units.groupby("property_id").size().reindex(properties["id"]).fillna(0)
+    slots = slots.add(pd.Series(1, index=property_days.index), fill_value=0).reindex(properties["id"]).clip(lower=1)
+    capacity = slots * period_days
+    money = report.groupby("property_id")[["billed", "paid", "balance", "arrears"]].sum()
+    summary = properties.rename(columns={"id": "property_id", "address": "property_address"}).set_index("property_id")
+    summary["tenants"] = report.groupby("property_id").size().reindex(summary.index).fillna(0).astype(int)
+    summary["units"] = units.groupby("property_id").size().reindex(summary.index).fillna(0).astype(int)
+    summary = summary.join(money, how="left").fillna({"billed": 0, "paid": 0, "balance": 0, "arrears": 0})
+    summary["occupancy_days"] = occupied.reindex(summary.index).fillna(0)
+    summary["occupancy_ratio"] = (summary["occupancy_days"] / capacity.reindex(summary.index)).round(4)
+    return report, summary.reset_index()
+
+def export_report(report: pd.DataFrame, summary: pd.DataFrame, report_format: str, level: str) -> bytes:
+    buffer = io.BytesIO()
+    if report_format == "xlsx":
+        with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
+            report.to_excel(writer, sheet_name="Locataires", index=False)
+            summary.to_excel(writer, sheet_name="Propriétés", index=False)
+        return buffer.getvalue()
+    frame = summary if level == "property" else report
+    if report_format == "parquet":
+        frame.to_parquet(buffer, index=False)
+        return buffer.getvalue()
+    return frame.to_csv(index=False).encode("utf-8")
+
+# Occupancy intervals
+# `occupancy_intervals` mirrors the "moved_in" entries of tenant_history with
+# real datetime bounds. Open leases end at OPEN_END instead of None/"", so
+# "occupied on date X" is a single range scan on the (start, end) index.
+OPEN_END = datetime(9999, 12, 31)
+
+def parse_day(value) -> Optional[datetime]:
+    if isinstance(value, datetime):
+        return value
+    if not value:
+        return None
+    try:
+        return datetime.strptime(str(value)[:10], "%Y-%m-%d")
+    except ValueError:
+        return None
+
+def occupancy_interval(history: dict) -> dict:
+    return {
+        "id": history["id"],
+        "tenant_id": history["tenant_id"],
+        "tenant_name": history.get("tenant_name"),
+        "property_id": history.get("property_id"),
+        "property_name": history.get("property_name"),
+        "unit_id": history.get("unit_id"),
+        "unit_number": history.get("unit_number"),
+        "monthly_rent": history.get("monthly_rent", 0),
+        "start": parse_day(history.get("start_date")) or datetime.min,
+        "end": parse_day(history.get("end_date")) or OPEN_END
+    }
+
+async def record_occupancy(history: dict):
+    interval = occupancy_interval(history)
+    await db.occupancy_intervals.replace_one({"id": interval["id"]}, interval, upsert=True)
+
+async def current_lease(tenant_id: str) -> Optional[dict]:
+    """The tenant's open "moved_in" entry: their latest move, unless it was a move out"""
+    latest = await db.tenant_history.find_one(
+        {"tenant_id": tenant_id, "action": {"$in": ["moved_in", "moved_out"]}},
+        sort=[("created_at", DESCENDING)]
+    )
+    return latest if latest and latest["action"] == "moved_in" else None
+
+async def close_lease(lease: dict, end_date: str, moved_at: datetime) -> dict:
+    """End a lease on end_date (or its own earlier end) and record the move out; the closed entry"""
+    end = lease.get("end_date")
+    if not (parse_day(end) and parse_day(end) <= parse_day(end_date)):
+        end = end_date
+    closed = await update_by_id(db.tenant_history, lease["id"], {"end_date": end})
+    moved_out = TenantHistory(**{
+        **closed,
+        "id": str(uuid.uuid4()),
+        "action": "moved_out",
+        "created_at": moved_at,
+        "updated_at": moved_at
+    })
+    await asyncio.gather(
+        db.tenant_history.insert_one(moved_out.dict()),
+        record_occupancy(closed)
+    )
+    return closed
+
+async def sync_tenant_occupancy(previous: dict, tenant: dict) -> list:
+    """Bring the lease history in line with an edit of the tenant; the (before, after) intervals that changed
+
+    Dates and rent edited on the tenant are edited in place on the current
+    lease. A move to another property or unit closes the current lease and
+    opens a new one, and a tenant left without a property has their lease
+    closed: past leases are kept as they were.
+    """
+    lease = await current_lease(tenant["id"])
+    if lease and (tenant.get("property_id"), tenant.get("unit_id")) == (lease.get("property_id"), lease.get("unit_id")):
+        edits = {"name": "tenant_name", "start_date": "start_date", "end_date": "end_date", "monthly_rent": "monthly_rent"}
+        fields = {
+            lease_field: tenant.get(field) for field, lease_field in edits.items()
+            if tenant.get(field) != previous.get(field)
+        }
+        if not fields.get("start_date", True):
+            # An emptied start date keeps the lease's own
+            del fields["start_date"]
+        if "monthly_rent" in fields:
+            fields["monthly_rent"] = fields["monthly_rent"] or 0
+        if not fields:
+            return []
+        updated = await update_by_id(db.tenant_history, lease["id"], fields)
+        await record_occupancy(updated)
+        return [(occupancy_interval(lease), occupancy_interval(updated))]
+
+    today = datetime.utcnow().strftime("%Y-%m-%d")
+    moved_at = datetime.utcnow()
+    changes = []
+    if lease:
+        closed = await close_lease(lease, today, moved_at)
+        changes.append((occupancy_interval(lease), occupancy_interval(closed)))
+    if not tenant.get("property_id"):
+        return changes
+
+    # A first lease starts on the tenant's start date; after an earlier lease
+    # the new one starts with the move, so the two never overlap
+    start_date = tenant.get("start_date") or today
+    if lease or await db.tenant_history.find_one({"tenant_id": tenant["id"], "action": "moved_in"}, {"_id": 1}):
+        start_date = start_date if (parse_day(start_date) or datetime.min) > parse_day(today) else today
+    lookups = Lookups()
+    property_data, unit_data = await asyncio.gather(
+        lookups.get(db.properties, tenant["property_id"]),
+        lookups.get(db.units, tenant.get("unit_id"))
+    )
+    history = TenantHistory(
+        tenant_id=tenant["id"],
+        tenant_name=tenant["name"],
+        property_id=tenant["property_id"],
+        property_name=property_data["address"] if property_data else "Inconnue",
+        unit_id=tenant.get("unit_id"),
+        unit_number=unit_data["unit_number"] if unit_data else None,
+        start_date=start_date,
+        end_date=tenant.get("end_date"),
+        monthly_rent=tenant.get("monthly_rent") or 0,
+        total_paid=0,
+        months_paid=0,
+        action="moved_in",
+        # Strictly after the move out, which may share its millisecond
+        created_at=moved_at + timedelta(milliseconds=1)
+    ).dict()
+    await asyncio.gather(
+        db.tenant_history.insert_one(history),
+        record_occupancy(history)
+    )
+    changes.append((None, occupancy_interval(history)))
+    return changes
+
+async def rebuild_occupancy_intervals():
+    """Regenerate every interval from tenant_history, past leases included"""
+    batch = []
+    count = 0
+    cursor = db.tenant_history.find({"action": "moved_in"}).batch_size(STREAM_BATCH_SIZE)
+    known_ids = set()
+    async for history in cursor:
+        known_ids.add(history["id"])
+        interval = occupancy_interval(history)
+        batch.append(ReplaceOne({"id": interval["id"]}, interval, upsert=True))
+        if len(batch) >= STREAM_BATCH_SIZE:
+            await db.occupancy_intervals.bulk_write(batch, ordered=False)
+            count += len(batch)
+            batch = []
+    if batch:
+        await db.occupancy_intervals.bulk_write(batch, ordered=False)
+        count += len(batch)
+
+    stale = db.occupancy_intervals.find({}, {"id": 1})
+    stale_ids = [interval["id"] async for interval in stale if interval["id"] not in known_ids]
+    if stale_ids:
+        await db.occupancy_intervals.delete_many({"id": {"$in": stale_ids}})
+    return {"intervals": count, "removed": len(stale_ids)}
+
+def format_interval(interval: dict) -> dict:
+    interval.pop("_id", None)
+    interval["start_date"] = interval.pop("start").strftime("%Y-%m-%d")
+    end = interval.pop("end")
+    interval["end_date"] = None if end == OPEN_END else end.strftime("%Y-%m-%d")
+    return interval
+
+# Sequence counters
+# Numbers are reserved with a single atomic $inc on a counter document, so
+# concurrent requests and workers never get the same number and deleted
+# documents never give theirs back. A counter created after documents were
+# already numbered is first raised to the highest number in use (`floor`),
+# once per counter and process.
+seeded_counters = set()
+
+async def _counter_inc(counter_id: str, update: dict):
+    try:
+        return await db.counters.find_one_and_update(
+            {"id": counter_id}, update, upsert=True, return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # Two upserts raced to create the counter, the other one won
+        return await db.counters.find_one_and_update(
+            {"id": counter_id}, update, return_document=ReturnDocument.AFTER
+        )
+
+async def allocate_sequence(counter_id: str, count: int = 1, floor=None) -> range:
+    """Reserve `count` consecutive numbers (a block for batch issuing)"""
+    if floor is not None and counter_id not in seeded_counters:
+        await _counter_inc(counter_id, {"$max": {"value": await floor()}})
+        seeded_counters.add(counter_id)
+    counter = await _counter_inc(counter_id, {"$inc": {"value": count}})
+    return range(counter["value"] - count + 1, counter["value"] + 1)
+
+async def allocate_receipt_numbers(count: int = 1, when: Optional[datetime] = None) -> List[str]:
+    """Receipt numbers REC-YYYYMM-NNNN, numbered per calendar month"""
+    when = when or datetime.now()
+    prefix = f"REC-{when.year}{when.month:02d}-"
+
+    async def highest_used():
+        result = await db.receipts.aggregate([
+            {"$match": {"receipt_number": {"$regex": f"^{prefix}[0-9]+$"}}},
+            {"$group": {
+                "_id": None,
+                "highest": {"$max": {"$toInt": {"$substrCP": ["$receipt_number", len(prefix), 12]}}}
+            }}
+        ]).to_list(1)
+        return result[0]["highest"] if result else 0
+
+    numbers = await allocate_sequence(f"receipts-{when.year}-{when.month:02d}", count, floor=highest_used)
+    return [f"{prefix}{number:04d}" for number in numbers]
+
+RECEIPT_RENUMBER_LEASE = "receipt-renumbering"
+
+async def renumber_duplicate_receipts() -> List[dict]:
+    """Give a fresh number to receipts sharing one, so the unique index can build
+
+    Receipts numbered from count_documents() before the counters could share a
+    number. The oldest keeps it, the others get the next free number of the
+    same month. Runs under a lease: the other workers wait for it to finish.
+    """
+    while not await acquire_lease(RECEIPT_RENUMBER_LEASE, 600):
+        await asyncio.sleep(1)
+    try:
+        duplicates = await db.receipts.aggregate([
+            {"$sort": {"created_at": ASCENDING, "id": ASCENDING}},
+            {"$group": {"_id": "$receipt_number", "ids": {"$push": "$id"}, "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}}
+        ], allowDiskUse=True).to_list(None)
+        renumbered = []
+        now = datetime.utcnow()
+        for group in duplicates:
+            old_number, ids = group["_id"], group["ids"][1:]
+            issued = re.match(r"^REC-(\d{4})(\d{2})-", old_number or "")
+            when = datetime(int(issued.group(1)), int(issued.group(2)), 1) if issued else None
+            numbers = await allocate_receipt_numbers(len(ids), when)
+            await db.receipts.bulk_write([
+                UpdateOne({"id": receipt_id}, {"$set": {"receipt_number": number, "updated_at": now}})
+                for receipt_id, number in zip(ids, numbers)
+            ], ordered=False)
+            for receipt_id, number in zip(ids, numbers):
+                logger.warning(f"Reçu {receipt_id}: numéro {old_number} en double, renuméroté {number}")
+                renumbered.append({"id": receipt_id, "old": old_number, "new": number})
+        return renumbered
+    finally:
+        await db.leases.delete_one({"id": RECEIPT_RENUMBER_LEASE, "holder": WORKER_ID})
+
+# Background jobs
+# Periodic jobs run in every worker, but each run first takes a lease document
+# in Mongo so that only one worker does the work per period. A lease expires on
+# its own if its holder dies.
+WORKER_ID = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+OVERDUE_SWEEP_INTERVAL_SECONDS = int(os.environ.get("OVERDUE_SWEEP_INTERVAL_SECONDS", "3600"))
+background_tasks = []
+
+async def acquire_lease(name: str, ttl_seconds: float) -> bool:
+    now = datetime.utcnow()
+    try:
+        lease = await db.leases.find_one_and_update(
+            {"id": name, "$or": [{"expires_at": {"$lt": now}}, {"holder": WORKER_ID}]},
+            {"$set": {"holder": WORKER_ID, "expires_at": now + timedelta(seconds=ttl_seconds)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # The lease exists and is held by another live worker
+        return False
+    return lease is not None
+
+async def run_leased_job(name: str, interval_seconds: float, job):
+    """Run `job` every interval in whichever worker holds the `name` lease, recording each run on the lease"""
+    while True:
+        try:
+            if await acquire_lease(name, interval_seconds * 2):
+                started = time.perf_counter()
+                result = await job()
+                await db.leases.update_one(
+                    {"id": name, "holder": WORKER_ID},
+                    {
+                        "$set": {
+                            "last_run_at": datetime.utcnow(),
+                            "last_result": result,
+                            "last_duration_ms": round((time.perf_counter() - started) * 1000, 1)
+                        },
+                        "$inc": {"runs": 1}
+                    }
+                )
+                logger.info(f"Tâche {name}: {result}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Échec de la tâche {name}: {e}")
+        await asyncio.sleep(interval_seconds)
+
+async def sweep_overdue_payments() -> dict:
+    """Move pending payments past their due date to overdue"""
+    overdue_filter = {
+        "status": PaymentStatus.pending.value,
+        "due_date": {"$lt": datetime.utcnow().strftime("%Y-%m-%d")}
+    }
+    months = await db.payments.aggregate([
+        {"$match": overdue_filter},
+        {"$group": {"_id": {"year": "$year", "month": "$month"}}}
+    ]).to_list(None)
+    if not months:
+        return {"transitioned": 0}
+    
+    result = await db.payments.update_many(
+        overdue_filter,
+        {"$set": {"status": PaymentStatus.overdue.value, "updated_at": datetime.utcnow()}}
+    )
+    await refresh_month_stats((m["_id"]["year"], m["_id"]["month"]) for m in months)
+    return {"transitioned": result.modified_count}
+
+# Tenant ledger
+# Every payment change appends entries to `ledger_entries`: the difference it
+# makes to the rent billed to the tenant (debit), the rent collected (credit)
+# and the number of paid months. Entries are never modified; a correction is a
+# new entry. `tenant_balances` keeps a running snapshot per tenant, moved by
+# the same deltas with $inc right after the entries are written, so a balance
+# is one document read. Tenant.months_paid follows the same deltas. Moving a
+# payment to overdue changes none of them, so the sweeper posts nothing. The
+# entries are the reference: verify_ledger() rebuilds any snapshot that no
+# longer matches them, and reconcile_ledger() appends adjustment entries when
+# payments changed outside the write paths (restores, existing data).
+LEDGER_VERIFY_INTERVAL_SECONDS = int(os.environ.get("LEDGER_VERIFY_INTERVAL_SECONDS", "86400"))
+# Tenants written to more recently than this are left for the next run, their
+# snapshot may be between an entry and its $inc
+LEDGER_SETTLE_SECONDS = 60
+LEDGER_TOLERANCE = 0.005
+# A reconcile holds this lease: two workers (startup, restores) reconciling at
+# once would both append the same adjustments
+LEDGER_RECONCILE_LEASE = "ledger-reconcile"
+LEDGER_RECONCILE_LEASE_SECONDS = 600
+LEDGER_RECONCILE_RETRIES = 5
+ledger_tasks = set()
+
+def ledger_effect(payment: dict):
+    """(debit, credit, paid months) a payment contributes to its tenant"""
+    amount = payment.get("amount") or 0
+    if payment.get("status") == PaymentStatus.paid:
+        return amount, amount, 1
+    return amount, 0, 0
+
+async def apply_ledger_entries(entries, count_months: bool = True):
+    if not entries:
+        return
+    await db.ledger_entries.insert_many(entries, ordered=False)
+    deltas = {}
+    for entry in entries:
+        delta = deltas.setdefault(entry["tenant_id"], {"debit": 0, "credit": 0, "months_paid": 0, "entries": 0})
+        delta["debit"] += entry["debit"]
+        delta["credit"] += entry["credit"]
+        delta["months_paid"] += entry["months_paid"]
+        delta["entries"] += 1
+    now = datetime.utcnow()
+    await db.tenant_balances.bulk_write([
+        UpdateOne(
+            {"id": tenant_id},
+            {
+                "$inc": {**delta, "balance": delta["debit"] - delta["credit"]},
+                "$set": {"tenant_id": tenant_id, "updated_at": now}
+            },
+            upsert=True
+        )
+        for tenant_id, delta in deltas.items()
+    ], ordered=False)
+    months = [(tenant_id, delta["months_paid"]) for tenant_id, delta in deltas.items() if delta["months_paid"]]
+    if months and count_months:
+        await db.tenants.bulk_write([
+            UpdateOne({"id": tenant_id}, {"$inc": {"months_paid": count}, "$set": {"updated_at": now}})
+            for tenant_id, count in months
+        ], ordered=False)
+
+def ledger_entry(tenant_id, reason, debit, credit, months_paid, payment=None, created_at=None) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "tenant_id": tenant_id,
+        "payment_id": payment["id"] if payment else None,
+        "year": payment.get("year") if payment else None,
+        "month": payment.get("month") if payment else None,
+        "reason": reason,
+        "debit": debit,
+        "credit": credit,
+        "months_paid": months_paid,
+        "created_at": created_at or datetime.utcnow()
+    }
+
+async def post_payment_changes(reason: str, removed=(), added=()):
+    """Append the ledger entries for payments going from `removed` to `added` states"""
+    changes = {}
+    for sign, payments in ((-1, removed), (1, added)):
+        for payment in payments:
+            change = changes.setdefault((payment["id"], payment["tenant_id"]), {"payment": payment, "effect": [0, 0, 0]})
+            change["payment"] = payment
+            for index, value in enumerate(ledger_effect(payment)):
+                change["effect"][index] += sign * value
+    now = datetime.utcnow()
+    entries = []
+    for (_, tenant_id), change in changes.items():
+        debit, credit, months = change["effect"]
+        if abs(debit) > LEDGER_TOLERANCE or abs(credit) > LEDGER_TOLERANCE or months:
+            entries.append(ledger_entry(tenant_id, reason, debit, credit, months, change["payment"], now))
+    await apply_ledger_entries(entries)
+
+async def _ledger_sums(match: Optional[dict] = None) -> dict:
+    groups = await db.ledger_entries.aggregate([
+        {"$match": match or {}},
+        {"$group": {
+            "_id": "$tenant_id",
+            "debit": {"$sum": "$debit"},
+            "credit": {"$sum": "$credit"},
+            "months_paid": {"$sum": "$months_paid"},
+            "entries": {"$sum": 1},
+            "last_entry_at": {"$max": "$created_at"}
+        }}
+    ]).to_list(None)
+    return {group.pop("_id"): group for group in groups}
+
+async def reconcile_ledger(reason: str = "adjustment", tenant_ids=None, wait: bool = True,
+                           only_if_empty: bool = False) -> Optional[dict]:
+    """Append entries so that every tenant's ledger (or these tenants') matches its current payments
+
+    Runs under the reconcile lease; None when another worker holds it and
+    `wait` is False, or with `only_if_empty` when the ledger already has
+    entries. Tenants with a payment or an entry written during the settle
+    window are left out (`busy`): between a payment write and its entry the
+    two disagree, and adjusting them would count the write twice.
+    """
+    while not await acquire_lease(LEDGER_RECONCILE_LEASE, LEDGER_RECONCILE_LEASE_SECONDS):
+        if not wait:
+            return None
+        await asyncio.sleep(1)
+    try:
+        if only_if_empty and await db.ledger_entries.find_one({}, {"_id": 1}):
+            return None
+        cutoff = datetime.utcnow() - timedelta(seconds=LEDGER_SETTLE_SECONDS)
+        match = {"tenant_id": {"$in": list(tenant_ids)}} if tenant_ids is not None else {}
+        expected = await db.payments.aggregate([
+            {"$match": match},
+            {"$group": {
+                "_id": "$tenant_id",
+                "debit": {"$sum": "$amount"},
+                "credit": {"$sum": {"$cond": [{"$eq": ["$status", PaymentStatus.paid.value]}, "$amount", 0]}},
+                "months_paid": {"$sum": {"$cond": [{"$eq": ["$status", PaymentStatus.paid.value]}, 1, 0]}}
+            }}
+        ]).to_list(None)
+        expected = {group.pop("_id"): group for group in expected if group["_id"]}
+        recorded = await _ledger_sums(match)
+
+        # Read after the sums, so that a write in flight during them shows up here
+        recent_payments, recent_entries = await asyncio.gather(
+            db.payments.distinct("tenant_id", {**match, "updated_at": {"$gt": cutoff}}),
+            db.ledger_entries.distinct("tenant_id", {**match, "created_at": {"$gt": cutoff}})
+        )
+        busy = set(recent_payments) | set(recent_entries)
+
+        entries = []
+        for tenant_id in (expected.keys() | recorded.keys()) - busy:
+            target = expected.get(tenant_id, {})
+            current = recorded.get(tenant_id, {})
+            debit = target.get("debit", 0) - current.get("debit", 0)
+            credit = target.get("credit", 0) - current.get("credit", 0)
+            months = target.get("months_paid", 0) - current.get("months_paid", 0)
+            if abs(debit) > LEDGER_TOLERANCE or abs(credit) > LEDGER_TOLERANCE or months:
+                entries.append(ledger_entry(tenant_id, reason, debit, credit, months))
+        for offset in range(0, len(entries), RESTORE_BATCH_SIZE):
+            await apply_ledger_entries(entries[offset:offset + RESTORE_BATCH_SIZE], count_months=False)
+
+        # Tenant documents may come with their own count (restores, the former
+        # counter): set it rather than add to it
+        now = datetime.utcnow()
+        months_paid = [(tenant_id, group["months_paid"]) for tenant_id, group in expected.items() if tenant_id not in busy]
+        for offset in range(0, len(months_paid), RESTORE_BATCH_SIZE):
+            await db.tenants.bulk_write([
+                UpdateOne({"id": tenant_id}, {"$set": {"months_paid": count, "updated_at": now}})
+                for tenant_id, count in months_paid[offset:offset + RESTORE_BATCH_SIZE]
+            ], ordered=False)
+        unpaid = {"$nin": list(expected.keys() | busy)}
+        if tenant_ids is not None:
+            unpaid["$in"] = list(tenant_ids)
+        await db.tenants.update_many(
+            {"id": unpaid, "months_paid": {"$ne": 0}},
+            {"$set": {"months_paid": 0, "updated_at": now}}
+        )
+        return {"tenants": len(expected), "adjusted": len(entries), "busy": sorted(busy)}
+    finally:
+        await db.leases.delete_one({"id": LEDGER_RECONCILE_LEASE, "holder": WORKER_ID})
+
+async def settle_ledger(reason: str = "adjustment", **options) -> Optional[dict]:
+    """Reconcile the ledger, then retry the busy tenants in the background once they settle"""
+    result = await reconcile_ledger(reason, **options)
+    if result is None:
+        return None
+
+    async def retry(tenant_ids):
+        for _ in range(LEDGER_RECONCILE_RETRIES):
+            if not tenant_ids:
+                return
+            await asyncio.sleep(LEDGER_SETTLE_SECONDS)
+            try:
+                tenant_ids = (await reconcile_ledger(reason, tenant_ids=tenant_ids))["busy"]
+            except Exception as e:
+                logger.error(f"Échec du rapprochement du grand livre: {e}")
+        if tenant_ids:
+            logger.warning(f"Grand livre non rapproché pour {len(tenant_ids)} locataires toujours actifs")
+
+    if result["busy"]:
+        task = asyncio.create_task(retry(result["busy"]))
+        ledger_tasks.add(task)
+        task.add_done_callback(ledger_tasks.discard)
+    return result
+
+async def verify_ledger() -> dict:
+    """Rebuild the balance snapshots (and months_paid) that disagree with the ledger entries"""
+    cutoff = datetime.utcnow() - timedelta(seconds=LEDGER_SETTLE_SECONDS)
+    sums = await _ledger_sums()
+    snapshots = await db.tenant_balances.find({}, {"_id": 0}).to_list(None)
+    snapshots = {snapshot["id"]: snapshot for snapshot in snapshots}
+    result = {"checked": 0, "repaired": 0, "busy": 0}
+
+    repairs = []
+    for tenant_id in sums.keys() | snapshots.keys():
+        totals = sums.get(tenant_id, {"debit": 0, "credit": 0, "months_paid": 0, "entries": 0, "last_entry_at": None})
+        snapshot = snapshots.get(tenant_id, {})
+        if (totals["last_entry_at"] and totals["last_entry_at"] > cutoff) or (
+            snapshot.get("updated_at") and snapshot["updated_at"] > cutoff
+        ):
+            result["busy"] += 1
+            continue
+        result["checked"] += 1
+        matches = (
+            abs(snapshot.get("debit", 0) - totals["debit"]) <= LEDGER_TOLERANCE
+            and abs(snapshot.get("credit", 0) - totals["credit"]) <= LEDGER_TOLERANCE
+            and abs(snapshot.get("balance", 0) - (totals["debit"] - totals["credit"])) <= LEDGER_TOLERANCE
+            and snapshot.get("months_paid", 0) == totals["months_paid"]
+            and snapshot.get("entries", 0) == totals["entries"]
+        )
+        if not matches:
+            repairs.append(ReplaceOne({"id": tenant_id}, {
+                "id": tenant_id,
+                "tenant_id": tenant_id,
+                "debit": totals["debit"],
+                "credit": totals["credit"],
+                "balance": totals["debit"] - totals["credit"],
+                "months_paid": totals["months_paid"],
+                "entries": totals["entries"],
+                "updated_at": datetime.utcnow()
+            }, upsert=True))
+    if repairs:
+        await db.tenant_balances.bulk_write(repairs, ordered=False)
+        result["repaired"] = len(repairs)
+
+    # Tenant.months_paid mirrors the snapshot
+    settled = {
+        tenant_id: totals["months_paid"] for tenant_id, totals in sums.items()
+        if not totals["last_entry_at"] or totals["last_entry_at"] <= cutoff
+    }
+    tenants = await db.tenants.find(
+        {"id": {"$in": list(settled)}, "updated_at": {"$lte": cutoff}}, {"id": 1, "months_paid": 1}
+    ).to_list(None)
+    drifted = [tenant for tenant in tenants if tenant.get("months_paid", 0) != settled[tenant["id"]]]
+    if drifted:
+        await db.tenants.bulk_write([
+            UpdateOne({"id": tenant["id"]}, {"$set": {"months_paid": settled[tenant["id"]]}})
+            for tenant in drifted
+        ], ordered=False)
+    result["months_paid_repaired"] = len(drifted)
+    if result["repaired"] or result["months_paid_repaired"]:
+        logger.warning(f"Soldes locataires corrigés: {result}")
+    return result
+
+# Deletions are recorded so that incremental backups can replay them
+async def record_deletion(collection: str, document_id: str):
+    await db.deletions.insert_one({
+        "collection": collection,
+        "id": document_id,
+        "deleted_at": datetime.utcnow()
+    })
+
+# Updates
+# A $set and the read of its result are one find_one_and_update, so a handler
+# never returns a document another request modified in between. Handlers that
+# adjust counters need the previous state too: with `previous=True` Mongo
+# returns the document before the update and the new one is derived from it,
+# still in a single round-trip.
+async def update_by_id(collection, document_id: str, fields: dict, previous: bool = False):
+    """$set `fields` on the document with this id; the new document, (before, after) with `previous`, or None"""
+    fields = {**fields, "updated_at": datetime.utcnow()}
+    if not previous:
+        return await collection.find_one_and_update(
+            {"id": document_id},
+            {"$set": fields},
+            return_document=ReturnDocument.AFTER
+        )
+    before = await collection.find_one_and_update({"id": document_id}, {"$set": fields})
+    if before is None:
+        return None
+    return before, {**before, **fields}
+
+# Request-scoped lookups
+# Handlers fetch the documents they need in concurrent asyncio.gather stages.
+# A Lookups instance lives for one request: the first lookup of a document
+# starts its query and every other lookup of it, concurrent or later, awaits
+# that same query.
+class Lookups:
+    def __init__(self):
+        self.documents = {}
+
+    async def get(self, collection, document_id: Optional[str]) -> Optional[dict]:
+        if not document_id:
+            return None
+        key = (collection.name, document_id)
+        if key not in self.documents:
+            self.documents[key] = asyncio.ensure_future(collection.find_one({"id": document_id}))
+        return await self.documents[key]
+
+# Settings
+# There is a single settings document, under the fixed id SETTINGS_ID, so that
+# concurrent first requests upsert the same document instead of each inserting
+# their own. Every worker keeps it in memory: it is loaded at startup, replaced
+# on update, and reloaded when another worker changes it, through a change
+# stream when Mongo supports them (replica sets) and by polling `updated_at`
+# every SETTINGS_POLL_INTERVAL_SECONDS otherwise.
+SETTINGS_ID = "app-settings"
+SETTINGS_POLL_INTERVAL_SECONDS = float(os.environ.get("SETTINGS_POLL_INTERVAL_SECONDS", "5"))
+
+async def ensure_settings_document() -> dict:
+    """The settings document, created with defaults (or from a legacy document) if missing"""
+    legacy = await db.settings.find_one({"id": {"$ne": SETTINGS_ID}}, sort=[("created_at", ASCENDING)])
+    initial = AppSettings(**(legacy or {})).dict()
+    initial.pop("id")
+    try:
+        settings = await db.settings.find_one_and_update(
+            {"id": SETTINGS_ID},
+            {"$setOnInsert": initial},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # Another worker inserted it first
+        settings = await db.settings.find_one({"id": SETTINGS_ID})
+    if legacy:
+        await db.settings.delete_many({"id": {"$ne": SETTINGS_ID}})
+    return settings
+
+class SettingsCache:
+    def __init__(self):
+        self.settings: Optional[dict] = None
+
+    async def get(self) -> dict:
+        if self.settings is None:
+            await self.reload()
+        return self.settings
+
+    def set(self, settings: dict):
+        self.settings = settings
+
+    async def reload(self):
+        self.settings = await db.settings.find_one({"id": SETTINGS_ID}) or await ensure_settings_document()
+
+settings_cache = SettingsCache()
+
+async def poll_changes(collection, on_change, stamp):
+    """Call `on_change` whenever `stamp()` (a cheap summary of the collection) changes"""
+    last = None
+    while True:
+        await asyncio.sleep(SETTINGS_POLL_INTERVAL_SECONDS)
+        try:
+            current = await stamp()
+            if current != last:
+                await on_change()
+                last = current
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Échec du suivi de {collection.name}: {e}")
+
+async def follow_changes(collection, on_change, stamp):
+    """Call `on_change` after changes to `collection`, made by any worker"""
+    while True:
+        try:
+            async with collection.watch() as stream:
+                # Changes made before the stream was open
+                await on_change()
+                async for _ in stream:
+                    await on_change()
+        except asyncio.CancelledError:
+            raise
+        except OperationFailure as e:
+            logger.info(f"Change streams indisponibles ({e.code}), {collection.name} suivi par interrogation")
+            break
+        except Exception as e:
+            logger.error(f"Flux {collection.name} interrompu: {e}")
+            await asyncio.sleep(SETTINGS_POLL_INTERVAL_SECONDS)
+    await poll_changes(collection, on_change, stamp)
+
+async def settings_stamp():
+    current = await db.settings.find_one({"id": SETTINGS_ID}, {"updated_at": 1})
+    return current.get("updated_at") if current else None
+
+async def watch_settings():
+    await follow_changes(db.settings, settings_cache.reload, settings_stamp)
+
+async def users_stamp():
+    # Creations and deletions change the count, updates set updated_at
+    latest, count = await asyncio.gather(
+        db.users.find_one({}, {"updated_at": 1}, sort=[("updated_at", DESCENDING)]),
+        db.users.count_documents({})
+    )
+    return (latest.get("updated_at") if latest else None, count)
+
+async def watch_users():
+    """Clear the user cache when any worker creates, changes or deletes a user"""
+    async def clear():
+        user_cache.clear()
+    await follow_changes(db.users, clear, users_stamp)
+
 # Routes
 @api_router.get("/")
 async def root():
@@ -336,11 +2251,31 @@ async def root():
 async def health():
     return {"status": "ok"}
 
+@api_router.get("/indexes")
+async def get_index_report(current_admin: User = Depends(get_admin_user)):
+    return index_report
+
 # Authentication endpoints
 @api_router.post("/auth/login", response_model=Token)
-async def login(user_login: UserLogin):
-    user = await db.users.find_one({"username": user_login.username})
-    if not user or not verify_password(user_login.password, user["hashed_password"]):
+async def login(user_login: UserLogin, request: Request):
+    client_ip = client_address(request)
+    if logins_in_flight.get(client_ip, 0) >= LOGIN_CONCURRENCY_PER_IP:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Trop de tentatives de connexion simultanées",
+            headers={"Retry-After": "1"}
+        )
+    
+    logins_in_flight[client_ip] = logins_in_flight.get(client_ip, 0) + 1
+    try:
+        user = await db.users.find_one({"username": user_login.username})
+        password_ok = user is not None and await verify_password_async(user_login.password, user["hashed_password"])
+    finally:
+        logins_in_flight[client_ip] -= 1
+        if logins_in_flight[client_ip] == 0:
+            del logins_in_flight[client_ip]
+    
+    if not password_ok:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Nom d'utilisateur ou mot de passe incorrect"
@@ -393,14 +2328,20 @@ async def create_user(user_data: UserCreate, current_admin: User = Depends(get_a
     
     # Store user with hashed password
     user_to_store = new_user.dict()
-    user_to_store["hashed_password"] = get_password_hash(password)
+    user_to_store["hashed_password"] = await get_password_hash_async(password)
     
     await db.users.insert_one(user_to_store)
+    user_cache.invalidate(new_user.username)
     return new_user
 
 @api_router.get("/auth/users", response_model=List[User])
-async def get_users(current_admin: User = Depends(get_admin_user)):
-    users = await db.users.find().to_list(1000)
+async def get_users(
+    response: Response,
+    after: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_admin: User = Depends(get_admin_user)
+):
+    users = await fetch_page(db.users, {}, after, limit, response)
     return [User(**{k: v for k, v in user.items() if k != "hashed_password"}) for user in users]
 
 @api_router.put("/auth/users/{user_id}/toggle-status")
@@ -412,8 +2353,9 @@ async def toggle_user_status(user_id: str, current_admin: User = Depends(get_adm
     new_status = not user["is_active"]
     await db.users.update_one(
         {"id": user_id},
-        {"$set": {"is_active": new_status}}
+        {"$set": {"is_active": new_status, "updated_at": datetime.utcnow()}}
     )
+    user_cache.invalidate(user["username"])
     
     return {"message": f"Utilisateur {'activé' if new_status else 'désactivé'}"}
 
@@ -426,12 +2368,17 @@ async def delete_user(user_id: str, current_admin: User = Depends(get_admin_user
             detail="Vous ne pouvez pas supprimer votre propre compte"
         )
     
-    result = await db.users.delete_one({"id": user_id})
-    if result.deleted_count == 0:
+    deleted_user = await db.users.find_one_and_delete({"id": user_id})
+    if deleted_user is None:
         raise HTTPException(status_code=404, detail="Utilisateur non trouvé")
+    user_cache.invalidate(deleted_user["username"])
     
     return {"message": "Utilisateur supprimé"}
 
+@api_router.get("/auth/cache-stats")
+async def get_user_cache_stats(current_admin: User = Depends(get_admin_user)):
+    return user_cache.stats()
+
 @api_router.get("/auth/me", response_model=User)
 async def get_current_user_info(current_user: User = Depends(get_current_user)):
     return current_user
@@ -439,33 +2386,16 @@ async def get_current_user_info(current_user: User = Depends(get_current_user)):
 # Settings endpoints
 @api_router.get("/settings", response_model=AppSettings)
 async def get_settings():
-    settings = await db.settings.find_one({})
-    if not settings:
-        # Create default settings
-        default_settings = AppSettings()
-        await db.settings.insert_one(default_settings.dict())
-        return default_settings
-    return AppSettings(**settings)
+    return AppSettings(**await settings_cache.get())
 
 @api_router.put("/settings", response_model=AppSettings)
 async def update_settings(settings_data: AppSettingsUpdate):
-    current_settings = await db.settings.find_one({})
-    if not current_settings:
-        # Create new settings
-        new_settings = AppSettings(**settings_data.dict())
-        await db.settings.insert_one(new_settings.dict())
-        return new_settings
-    
-    # Update existing settings
     update_data = settings_data.dict(exclude_unset=True)
-    update_data["updated_at"] = datetime.utcnow()
-    
-    await db.settings.update_one(
-        {"id": current_settings["id"]},
-        {"$set": update_data}
-    )
-    
-    updated_settings = await db.settings.find_one({"id": current_settings["id"]})
+    updated_settings = await update_by_id(db.settings, SETTINGS_ID, update_data)
+    if updated_settings is None:
+        await ensure_settings_document()
+        updated_settings = await update_by_id(db.settings, SETTINGS_ID, update_data)
+    settings_cache.set(updated_settings)
     return AppSettings(**updated_settings)
 
 @api_router.get("/currencies")
@@ -489,11 +2419,16 @@ async def create_property(property_data: PropertyCreate):
     property_dict = property_data.dict()
     property_obj = Property(**property_dict)
     await db.properties.insert_one(property_obj.dict())
+    await bump_totals(properties=1)
     return property_obj
 
 @api_router.get("/properties", response_model=List[Property])
-async def get_properties():
-    properties = await db.properties.find().to_list(1000)
+async def get_properties(
+    response: Response,
+    after: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)
+):
+    properties = await fetch_page(db.properties, {}, after, limit, response)
     return [Property(**prop) for prop in properties]
 
 @api_router.get("/properties/{property_id}", response_model=Property)
@@ -505,15 +2440,9 @@ async def get_property(property_id: str):
 
 @api_router.put("/properties/{property_id}", response_model=Property)
 async def update_property(property_id: str, property_data: PropertyCreate):
-    update_data = property_data.dict()
-    result = await db.properties.update_one(
-        {"id": property_id}, 
-        {"$set": update_data}
-    )
-    if result.matched_count == 0:
+    updated_property = await update_by_id(db.properties, property_id, property_data.dict())
+    if updated_property is None:
         raise HTTPException(status_code=404, detail="Propriété non trouvée")
-    
-    updated_property = await db.properties.find_one({"id": property_id})
     return Property(**updated_property)
 
 @api_router.delete("/properties/{property_id}")
@@ -521,6 +2450,8 @@ async def delete_property(property_id: str):
     result = await db.properties.delete_one({"id": property_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Propriété non trouvée")
+    await bump_totals(properties=-1)
+    await record_deletion("properties", property_id)
     return {"message": "Propriété supprimée"}
 
 # Units endpoints (Appartements/Studios)
@@ -529,11 +2460,16 @@ async def create_unit(unit_data: UnitCreate):
     unit_dict = unit_data.dict()
     unit_obj = Unit(**unit_dict)
     await db.units.insert_one(unit_obj.dict())
+    await bump_totals(units=1, occupied_units=int(unit_obj.status == PropertyStatus.occupied))
     return unit_obj
 
 @api_router.get("/units", response_model=List[Unit])
-async def get_units():
-    units = await db.units.find().to_list(1000)
+async def get_units(
+    response: Response,
+    after: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)
+):
+    units = await fetch_page(db.units, {}, after, limit, response)
     return [Unit(**unit) for unit in units]
 
 @api_router.get("/units/property/{property_id}", response_model=List[Unit])
@@ -550,22 +2486,22 @@ async def get_unit(unit_id: str):
 
 @api_router.put("/units/{unit_id}", response_model=Unit)
 async def update_unit(unit_id: str, unit_data: UnitCreate):
-    update_data = unit_data.dict()
-    result = await db.units.update_one(
-        {"id": unit_id}, 
-        {"$set": update_data}
-    )
-    if result.matched_count == 0:
+    result = await update_by_id(db.units, unit_id, unit_data.dict(), previous=True)
+    if result is None:
         raise HTTPException(status_code=404, detail="Unité non trouvée")
+    previous_unit, updated_unit = result
     
-    updated_unit = await db.units.find_one({"id": unit_id})
+    was_occupied = previous_unit.get("status") == PropertyStatus.occupied
+    await bump_totals(occupied_units=int(unit_data.status == PropertyStatus.occupied) - int(was_occupied))
     return Unit(**updated_unit)
 
 @api_router.delete("/units/{unit_id}")
 async def delete_unit(unit_id: str):
-    result = await db.units.delete_one({"id": unit_id})
-    if result.deleted_count == 0:
+    deleted_unit = await db.units.find_one_and_delete({"id": unit_id})
+    if deleted_unit is None:
         raise HTTPException(status_code=404, detail="Unité non trouvée")
+    await record_deletion("units", unit_id)
+    await bump_totals(units=-1, occupied_units=-int(deleted_unit.get("status") == PropertyStatus.occupied))
     return {"message": "Unité supprimée"}
 
 # Tenants endpoints
@@ -573,27 +2509,35 @@ async def delete_unit(unit_id: str):
 async def create_tenant(tenant_data: TenantCreate):
     tenant_dict = tenant_data.dict()
     tenant_obj = Tenant(**tenant_dict)
-    await db.tenants.insert_one(tenant_obj.dict())
+    lookups = Lookups()
     
-    # Update unit status if unit_id is provided
-    if tenant_obj.unit_id:
-        await db.units.update_one(
-            {"id": tenant_obj.unit_id},
-            {"$set": {"status": PropertyStatus.occupied}}
-        )
-    elif tenant_obj.property_id:
-        await db.properties.update_one(
-            {"id": tenant_obj.property_id},
-            {"$set": {"status": PropertyStatus.occupied}}
-        )
+    async def mark_occupied():
+        # Update unit status if unit_id is provided
+        if tenant_obj.unit_id:
+            previous_unit = await db.units.find_one_and_update(
+                {"id": tenant_obj.unit_id},
+                {"$set": {"status": PropertyStatus.occupied, "updated_at": datetime.utcnow()}}
+            )
+            if previous_unit and previous_unit.get("status") != PropertyStatus.occupied:
+                await bump_totals(occupied_units=1)
+            return previous_unit
+        if tenant_obj.property_id:
+            await db.properties.update_one(
+                {"id": tenant_obj.property_id},
+                {"$set": {"status": PropertyStatus.occupied, "updated_at": datetime.utcnow()}}
+            )
+        return None
+    
+    # The unit update returns the unit as it was, which still has its number
+    _, _, unit_data, property_data = await asyncio.gather(
+        db.tenants.insert_one(tenant_obj.dict()),
+        bump_totals(tenants=1),
+        mark_occupied(),
+        lookups.get(db.properties, tenant_obj.property_id)
+    )
     
     # Create history entry
     if tenant_obj.property_id:
-        property_data = await db.properties.find_one({"id": tenant_obj.property_id})
-        unit_data = None
-        if tenant_obj.unit_id:
-            unit_data = await db.units.find_one({"id": tenant_obj.unit_id})
-        
         history_entry = TenantHistory(
             tenant_id=tenant_obj.id,
             tenant_name=tenant_obj.name,
@@ -608,13 +2552,24 @@ async def create_tenant(tenant_data: TenantCreate):
             months_paid=0,
             action="moved_in"
         )
-        await db.tenant_history.insert_one(history_entry.dict())
+        await asyncio.gather(
+            db.tenant_history.insert_one(history_entry.dict()),
+            record_occupancy(history_entry.dict())
+        )
     
     return tenant_obj
 
 @api_router.get("/tenants", response_model=List[Tenant])
-async def get_tenants():
-    tenants = await db.tenants.find().to_list(1000)
+async def get_tenants(
+    response: Response,
+    after: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = None
+):
+    projection = field_projection(Tenant, fields)
+    tenants = await fetch_page(db.tenants, {}, after, limit, response, projection)
+    if projection:
+        return projected_response(tenants, response)
     return [Tenant(**tenant) for tenant in tenants]
 
 @api_router.get("/tenants/{tenant_id}", response_model=Tenant)
@@ -624,17 +2579,33 @@ async def get_tenant(tenant_id: str):
         raise HTTPException(status_code=404, detail="Locataire non trouvé")
     return Tenant(**tenant_data)
 
+@api_router.get("/tenants/{tenant_id}/balance", response_model=TenantBalance)
+async def get_tenant_balance(tenant_id: str):
+    balance = await db.tenant_balances.find_one({"id": tenant_id})
+    if balance is None:
+        if not await db.tenants.find_one({"id": tenant_id}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Locataire non trouvé")
+        return TenantBalance(tenant_id=tenant_id)
+    return TenantBalance(**balance)
+
+@api_router.get("/tenants/{tenant_id}/ledger", response_model=List[LedgerEntry])
+async def get_tenant_ledger(tenant_id: str, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)):
+    entries = await db.ledger_entries.find({"tenant_id": tenant_id}).sort("created_at", DESCENDING).to_list(limit)
+    return [LedgerEntry(**entry) for entry in entries]
+
 @api_router.put("/tenants/{tenant_id}", response_model=Tenant)
 async def update_tenant(tenant_id: str, tenant_data: TenantCreate):
-    update_data = tenant_data.dict()
-    result = await db.tenants.update_one(
-        {"id": tenant_id}, 
-        {"$set": update_data}
-    )
-    if result.matched_count == 0:
+    result = await update_by_id(db.tenants, tenant_id, tenant_data.dict(), previous=True)
+    if result is None:
         raise HTTPException(status_code=404, detail="Locataire non trouvé")
+    previous_tenant, updated_tenant = result
     
-    updated_tenant = await db.tenants.find_one({"id": tenant_id})
+    # Keep the lease history in line with the edited dates, rent, property and
+    # unit, and recompute the closed months whose occupancy changed
+    changes = await sync_tenant_occupancy(previous_tenant, updated_tenant)
+    floor = await earliest_payment_month() if changes else None
+    if floor:
+        await invalidate_rollups(set().union(*(lease_change_months(before, after, floor) for before, after in changes)))
     return Tenant(**updated_tenant)
 
 @api_router.delete("/tenants/{tenant_id}")
@@ -642,6 +2613,15 @@ async def delete_tenant(tenant_id: str):
     result = await db.tenants.delete_one({"id": tenant_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Locataire non trouvé")
+    # The tenant leaves: their current lease ends today, past leases stay in
+    # the history and the occupancy index
+    lease, _, _ = await asyncio.gather(
+        current_lease(tenant_id),
+        bump_totals(tenants=-1),
+        record_deletion("tenants", tenant_id)
+    )
+    if lease:
+        await close_lease(lease, datetime.utcnow().strftime("%Y-%m-%d"), datetime.utcnow())
     return {"message": "Locataire supprimé"}
 
 # Payments endpoints
@@ -650,11 +2630,104 @@ async def create_payment(payment_data: PaymentCreate):
     payment_dict = payment_data.dict()
     payment_obj = Payment(**payment_dict)
     await db.payments.insert_one(payment_obj.dict())
+    await asyncio.gather(
+        bump_payment_stats(added=[payment_obj.dict()]),
+        post_payment_changes("created", added=[payment_obj.dict()])
+    )
     return payment_obj
 
+@api_router.post("/payments/schedule")
+async def generate_payment_schedule(schedule: PaymentScheduleCreate):
+    """Créer en une fois les échéances en attente de tous les locataires actifs du mois"""
+    started = time.perf_counter()
+    last_day = calendar.monthrange(schedule.year, schedule.month)[1]
+    first_date = f"{schedule.year}-{schedule.month:02d}-01"
+    last_date = f"{schedule.year}-{schedule.month:02d}-{last_day:02d}"
+    due_date = f"{schedule.year}-{schedule.month:02d}-{min(schedule.due_day, last_day):02d}"
+    
+    # Locataires dont le bail couvre au moins un jour du mois
+    tenants = db.tenants.find(
+        {
+            "$and": [
+                {"$or": [{"start_date": {"$lte": last_date}}, {"start_date": None}, {"start_date": ""}]},
+                {"$or": [{"end_date": {"$gte": first_date}}, {"end_date": None}, {"end_date": ""}]}
+            ]
+        },
+        {"id": 1, "property_id": 1, "unit_id": 1, "monthly_rent": 1}
+    ).batch_size(STREAM_BATCH_SIZE)
+    
+    active_tenants = 0
+    skipped = 0
+    payments = []
+    async for tenant in tenants:
+        active_tenants += 1
+        if not tenant.get("property_id") or not tenant.get("monthly_rent"):
+            skipped += 1
+            continue
+        payment = Payment(
+            tenant_id=tenant["id"],
+            property_id=tenant["property_id"],
+            unit_id=tenant.get("unit_id"),
+            month=schedule.month,
+            year=schedule.year,
+            amount=tenant["monthly_rent"],
+            due_date=due_date
+        ).dict()
+        payment["scheduled"] = True
+        payments.append(payment)
+    
+    # Upsert on (tenant_id, year, month): an existing entry for the month, generated
+    # or entered by hand, is left alone, so the generator can be re-run safely
+    created = []
+    for offset in range(0, len(payments), RESTORE_BATCH_SIZE):
+        chunk = payments[offset:offset + RESTORE_BATCH_SIZE]
+        operations = [
+            UpdateOne(
+                {"tenant_id": p["tenant_id"], "year": p["year"], "month": p["month"]},
+                {"$setOnInsert": p},
+                upsert=True
+            )
+            for p in chunk
+        ]
+        try:
+            result = await db.payments.bulk_write(operations, ordered=False)
+            upserted = result.upserted_ids
+        except BulkWriteError as e:
+            # A concurrent run inserted the same entries first
+            upserted = {entry["index"]: entry["_id"] for entry in e.details.get("upserted", [])}
+        created.extend(chunk[index] for index in upserted)
+    
+    await asyncio.gather(
+        bump_payment_stats(added=created),
+        post_payment_changes("scheduled", added=created)
+    )
+    
+    return {
+        "month": schedule.month,
+        "year": schedule.year,
+        "active_tenants": active_tenants,
+        "created": len(created),
+        "existing": len(payments) - len(created),
+        "skipped": skipped,
+        "duration_ms": round((time.perf_counter() - started) * 1000, 1)
+    }
+
 @api_router.get("/payments", response_model=List[Payment])
-async def get_payments():
-    payments = await db.payments.find().to_list(1000)
+async def get_payments(
+    request: Request,
+    response: Response,
+    after: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    stream: bool = False,
+    fields: Optional[str] = None
+):
+    projection = field_projection(Payment, fields)
+    if wants_stream(request, stream):
+        query = decode_cursor(after) if after else {}
+        return stream_documents(db.payments.find(query, projection).sort(PAGE_SORT), request)
+    payments = await fetch_page(db.payments, {}, after, limit, response, projection)
+    if projection:
+        return projected_response(payments, response)
     return [Payment(**payment) for payment in payments]
 
 @api_router.get("/payments/tenant/{tenant_id}", response_model=List[Payment])
@@ -664,111 +2737,270 @@ async def get_tenant_payments(tenant_id: str):
 
 @api_router.put("/payments/{payment_id}", response_model=Payment)
 async def update_payment(payment_id: str, payment_data: PaymentCreate):
-    update_data = payment_data.dict()
-    result = await db.payments.update_one(
-        {"id": payment_id}, 
-        {"$set": update_data}
-    )
-    if result.matched_count == 0:
+    result = await update_by_id(db.payments, payment_id, payment_data.dict(), previous=True)
+    if result is None:
         raise HTTPException(status_code=404, detail="Paiement non trouvé")
-    
-    updated_payment = await db.payments.find_one({"id": payment_id})
+    previous_payment, updated_payment = result
+    await asyncio.gather(
+        bump_payment_stats(removed=[previous_payment], added=[updated_payment]),
+        post_payment_changes("updated", removed=[previous_payment], added=[updated_payment])
+    )
     return Payment(**updated_payment)
 
+MARK_PAID_CONCURRENCY = 64
+
+async def transition_to_paid(payment_id: str, paid_date: str):
+    """Mark a payment paid unless it already is; (before, after) or None if nothing changed"""
+    update = {
+        "status": PaymentStatus.paid.value,
+        "paid_date": paid_date,
+        "updated_at": datetime.utcnow()
+    }
+    previous_payment = await db.payments.find_one_and_update(
+        {"id": payment_id, "status": {"$ne": PaymentStatus.paid.value}},
+        {"$set": update}
+    )
+    if previous_payment is None:
+        return None
+    return previous_payment, {**previous_payment, **update}
+
 @api_router.put("/payments/{payment_id}/mark-paid")
 async def mark_payment_paid(payment_id: str):
-    from datetime import date
-    result = await db.payments.update_one(
-        {"id": payment_id}, 
-        {"$set": {"status": PaymentStatus.paid, "paid_date": date.today().strftime("%Y-%m-%d")}}
+    transition = await transition_to_paid(payment_id, datetime.utcnow().strftime("%Y-%m-%d"))
+    if transition is None:
+        # Already paid: nothing to count again
+        payment = await db.payments.find_one({"id": payment_id})
+        if payment is None:
+            raise HTTPException(status_code=404, detail="Paiement non trouvé")
+        return Payment(**payment)
+    
+    previous_payment, updated_payment = transition
+    await asyncio.gather(
+        bump_payment_stats(removed=[previous_payment], added=[updated_payment]),
+        post_payment_changes("paid", removed=[previous_payment], added=[updated_payment])
     )
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Paiement non trouvé")
+    return Payment(**updated_payment)
+
+@api_router.post("/payments/mark-paid")
+async def mark_payments_paid(bulk: PaymentBulkMarkPaid):
+    """Marquer un lot de paiements comme payés (import de rapprochement)"""
+    started = time.perf_counter()
+    paid_date = bulk.paid_date or datetime.utcnow().strftime("%Y-%m-%d")
+    payment_ids = list(dict.fromkeys(bulk.payment_ids))
     
-    # Update tenant's months_paid count
-    payment = await db.payments.find_one({"id": payment_id})
-    if payment:
-        await db.tenants.update_one(
-            {"id": payment["tenant_id"]},
-            {"$inc": {"months_paid": 1}}
-        )
+    transitions = []
+    for offset in range(0, len(payment_ids), MARK_PAID_CONCURRENCY):
+        chunk = payment_ids[offset:offset + MARK_PAID_CONCURRENCY]
+        transitions.extend(await asyncio.gather(*(transition_to_paid(pid, paid_date) for pid in chunk)))
     
-    updated_payment = await db.payments.find_one({"id": payment_id})
-    return Payment(**updated_payment)
+    transitioned = {t[1]["id"]: t for t in transitions if t is not None}
+    unchanged = [pid for pid in payment_ids if pid not in transitioned]
+    existing = await db.payments.find({"id": {"$in": unchanged}}, {"id": 1}).to_list(None) if unchanged else []
+    already_paid = {payment["id"] for payment in existing}
+    
+    removed = [before for before, _ in transitioned.values()]
+    added = [after for _, after in transitioned.values()]
+    await asyncio.gather(
+        bump_payment_stats(removed=removed, added=added),
+        post_payment_changes("paid", removed=removed, added=added)
+    )
+    
+    return {
+        "requested": len(payment_ids),
+        "paid": len(transitioned),
+        "already_paid": len(already_paid),
+        "not_found": [pid for pid in unchanged if pid not in already_paid],
+        "duration_ms": round((time.perf_counter() - started) * 1000, 1)
+    }
 
 @api_router.delete("/payments/{payment_id}")
 async def delete_payment(payment_id: str):
-    result = await db.payments.delete_one({"id": payment_id})
-    if result.deleted_count == 0:
+    deleted_payment = await db.payments.find_one_and_delete({"id": payment_id})
+    if deleted_payment is None:
         raise HTTPException(status_code=404, detail="Paiement non trouvé")
+    await asyncio.gather(
+        bump_payment_stats(removed=[deleted_payment]),
+        post_payment_changes("deleted", removed=[deleted_payment])
+    )
+    await record_deletion("payments", payment_id)
     return {"message": "Paiement supprimé"}
 
 # Receipts endpoints
+async def get_receipt_currency():
+    settings = await settings_cache.get()
+    currency = settings.get("currency", "XOF")
+    return currency, CURRENCY_SYMBOLS.get(currency, "CFA")
+
+def build_receipt(receipt_number, payment, tenant, property_data, unit_data, currency, notes) -> Receipt:
+    return Receipt(
+        receipt_number=receipt_number,
+        tenant_id=tenant["id"],
+        tenant_name=tenant["name"],
+        tenant_phone=tenant.get("phone", "Non renseigné"),
+        property_id=payment["property_id"],
+        property_name=property_data["address"],
+        unit_id=payment.get("unit_id"),
+        unit_number=unit_data["unit_number"] if unit_data else None,
+        payment_id=payment["id"],
+        amount=payment["amount"],
+        currency=currency[0],
+        currency_symbol=currency[1],
+        payment_date=payment.get("paid_date", datetime.now().strftime("%Y-%m-%d")),
+        due_date=payment.get("due_date", datetime.now().strftime("%Y-%m-%d")),
+        period_month=payment["month"],
+        period_year=payment["year"],
+        payment_method=payment.get("payment_method", "Espèces"),
+        months_paid_total=tenant.get("months_paid", 0),
+        notes=notes
+    )
+
 @api_router.post("/receipts", response_model=Receipt)
 async def create_receipt(receipt_data: ReceiptCreate):
-    # Get payment details
-    payment = await db.payments.find_one({"id": receipt_data.payment_id})
+    lookups = Lookups()
+    payment, tenant, currency = await asyncio.gather(
+        lookups.get(db.payments, receipt_data.payment_id),
+        lookups.get(db.tenants, receipt_data.tenant_id),
+        get_receipt_currency()
+    )
     if not payment:
         raise HTTPException(status_code=404, detail="Paiement non trouvé")
-    
-    # Get tenant details
-    tenant = await db.tenants.find_one({"id": receipt_data.tenant_id})
     if not tenant:
         raise HTTPException(status_code=404, detail="Locataire non trouvé")
     
-    # Get property details
-    property_data = await db.properties.find_one({"id": payment["property_id"]})
+    # Property, unit and receipt number only depend on the payment
+    property_data, unit_data, receipt_numbers = await asyncio.gather(
+        lookups.get(db.properties, payment["property_id"]),
+        lookups.get(db.units, payment.get("unit_id")),
+        allocate_receipt_numbers()
+    )
     if not property_data:
         raise HTTPException(status_code=404, detail="Propriété non trouvée")
+    receipt_number = receipt_numbers[0]
+    
+    receipt_obj = build_receipt(receipt_number, payment, tenant, property_data, unit_data, currency, receipt_data.notes)
+    await db.receipts.insert_one(receipt_obj.dict())
+    return receipt_obj
+
+async def fetch_by_ids(collection, ids) -> dict:
+    ids = list({item_id for item_id in ids if item_id})
+    if not ids:
+        return {}
+    documents = await collection.find({"id": {"$in": ids}}).to_list(None)
+    return {document["id"]: document for document in documents}
+
+@api_router.post("/receipts/batch")
+async def create_receipts_batch(batch: ReceiptBatchCreate):
+    """Émettre les reçus de plusieurs paiements en une fois (fin de mois)"""
+    if batch.payment_ids:
+        payments = await db.payments.find({"id": {"$in": batch.payment_ids}}).to_list(None)
+        requested_ids = list(dict.fromkeys(batch.payment_ids))
+    elif batch.month and batch.year:
+        payments = await db.payments.find({
+            "month": batch.month,
+            "year": batch.year,
+            "status": PaymentStatus.paid
+        }).to_list(None)
+        requested_ids = [payment["id"] for payment in payments]
+    else:
+        raise HTTPException(status_code=400, detail="Indiquez payment_ids ou month/year")
     
-    # Get unit details if exists
-    unit_data = None
-    if payment.get("unit_id"):
-        unit_data = await db.units.find_one({"id": payment["unit_id"]})
+    payments = {payment["id"]: payment for payment in payments}
     
-    # Get app settings for currency
-    settings = await db.settings.find_one({})
-    if not settings:
-        settings = {"currency": "XOF"}
+    # Everything the receipts reference, fetched in a handful of $in queries
+    tenants, properties, units, existing_receipts, currency = await asyncio.gather(
+        fetch_by_ids(db.tenants, (p["tenant_id"] for p in payments.values())),
+        fetch_by_ids(db.properties, (p["property_id"] for p in payments.values())),
+        fetch_by_ids(db.units, (p.get("unit_id") for p in payments.values())),
+        db.receipts.find({"payment_id": {"$in": list(payments)}}, {"payment_id": 1, "receipt_number": 1}).to_list(None),
+        get_receipt_currency()
+    )
+    already_issued = {receipt["payment_id"]: receipt["receipt_number"] for receipt in existing_receipts}
     
-    currency = settings.get("currency", "XOF")
-    currency_symbol = CURRENCY_SYMBOLS.get(currency, "CFA")
+    items = {}
+    issuable = []
+    for payment_id in requested_ids:
+        payment = payments.get(payment_id)
+        if payment is None:
+            items[payment_id] = {"payment_id": payment_id, "status": "error", "detail": "Paiement non trouvé"}
+        elif payment_id in already_issued:
+            items[payment_id] = {
+                "payment_id": payment_id,
+                "status": "exists",
+                "receipt_number": already_issued[payment_id]
+            }
+        elif payment["tenant_id"] not in tenants:
+            items[payment_id] = {"payment_id": payment_id, "status": "error", "detail": "Locataire non trouvé"}
+        elif payment["property_id"] not in properties:
+            items[payment_id] = {"payment_id": payment_id, "status": "error", "detail": "Propriété non trouvée"}
+        else:
+            issuable.append(payment)
     
-    # Generate receipt number
-    current_date = datetime.now()
-    receipt_count = await db.receipts.count_documents({}) + 1
-    receipt_number = f"REC-{current_date.year}{current_date.month:02d}-{receipt_count:04d}"
+    receipts = []
+    if issuable:
+        numbers = await allocate_receipt_numbers(len(issuable))
+        for receipt_number, payment in zip(numbers, issuable):
+            try:
+                receipt = build_receipt(
+                    receipt_number,
+                    payment,
+                    tenants[payment["tenant_id"]],
+                    properties[payment["property_id"]],
+                    units.get(payment.get("unit_id")),
+                    currency,
+                    batch.notes
+                )
+            except ValueError as e:
+                items[payment["id"]] = {"payment_id": payment["id"], "status": "error", "detail": str(e)}
+                continue
+            receipts.append(receipt)
     
-    # Create receipt
-    receipt_dict = {
-        "receipt_number": receipt_number,
-        "tenant_id": receipt_data.tenant_id,
-        "tenant_name": tenant["name"],
-        "tenant_phone": tenant.get("phone", "Non renseigné"),
-        "property_id": payment["property_id"],
-        "property_name": property_data["address"],
-        "unit_id": payment.get("unit_id"),
-        "unit_number": unit_data["unit_number"] if unit_data else None,
-        "payment_id": receipt_data.payment_id,
-        "amount": payment["amount"],
-        "currency": currency,
-        "currency_symbol": currency_symbol,
-        "payment_date": payment.get("paid_date", datetime.now().strftime("%Y-%m-%d")),
-        "due_date": payment.get("due_date", datetime.now().strftime("%Y-%m-%d")),
-        "period_month": payment["month"],
-        "period_year": payment["year"],
-        "payment_method": payment.get("payment_method", "Espèces"),
-        "months_paid_total": tenant.get("months_paid", 0),
-        "notes": receipt_data.notes
-    }
+    failed_indexes = {}
+    if receipts:
+        try:
+            await db.receipts.insert_many([receipt.dict() for receipt in receipts], ordered=False)
+        except BulkWriteError as e:
+            failed_indexes = {error["index"]: error["errmsg"] for error in e.details.get("writeErrors", [])}
     
-    receipt_obj = Receipt(**receipt_dict)
-    await db.receipts.insert_one(receipt_obj.dict())
-    return receipt_obj
+    for index, receipt in enumerate(receipts):
+        if index in failed_indexes:
+            items[receipt.payment_id] = {
+                "payment_id": receipt.payment_id,
+                "status": "error",
+                "detail": failed_indexes[index]
+            }
+        else:
+            items[receipt.payment_id] = {
+                "payment_id": receipt.payment_id,
+                "status": "created",
+                "receipt_id": receipt.id,
+                "receipt_number": receipt.receipt_number
+            }
+    
+    results = [items[payment_id] for payment_id in requested_ids]
+    return {
+        "requested": len(results),
+        "created": sum(1 for item in results if item["status"] == "created"),
+        "existing": sum(1 for item in results if item["status"] == "exists"),
+        "failed": sum(1 for item in results if item["status"] == "error"),
+        "items": results
+    }
 
 @api_router.get("/receipts", response_model=List[Receipt])
-async def get_receipts():
-    receipts = await db.receipts.find().sort("created_at", -1).to_list(1000)
+async def get_receipts(
+    request: Request,
+    response: Response,
+    after: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    stream: bool = False,
+    fields: Optional[str] = None
+):
+    projection = field_projection(Receipt, fields)
+    if wants_stream(request, stream):
+        query = decode_cursor(after) if after else {}
+        return stream_documents(db.receipts.find(query, projection).sort(PAGE_SORT), request)
+    receipts = await fetch_page(db.receipts, {}, after, limit, response, projection)
+    if projection:
+        return projected_response(receipts, response)
     return [Receipt(**receipt) for receipt in receipts]
 
 @api_router.get("/receipts/tenant/{tenant_id}", response_model=List[Receipt])
@@ -788,236 +3020,643 @@ async def delete_receipt(receipt_id: str):
     result = await db.receipts.delete_one({"id": receipt_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Reçu non trouvé")
+    await record_deletion("receipts", receipt_id)
     return {"message": "Reçu supprimé"}
 
 # History and Search endpoints
 @api_router.get("/history/tenant/{tenant_id}", response_model=List[TenantHistory])
-async def get_tenant_history(tenant_id: str):
+async def get_tenant_history(tenant_id: str, request: Request, stream: bool = False):
+    if wants_stream(request, stream):
+        cursor = db.tenant_history.find({"tenant_id": tenant_id}).sort("created_at", -1)
+        return stream_documents(cursor, request)
     history = await db.tenant_history.find({"tenant_id": tenant_id}).sort("created_at", -1).to_list(1000)
     return [TenantHistory(**h) for h in history]
 
 @api_router.get("/search/occupancy")
 async def search_occupancy_by_date(date: str):
     """Rechercher qui occupait quoi à une date donnée"""
-    try:
-        # Trouver tous les locataires actifs à cette date
-        active_tenants = await db.tenants.find({
-            "$and": [
-                {"start_date": {"$lte": date}},
-                {
-                    "$or": [
-                        {"end_date": {"$gte": date}},
-                        {"end_date": None},
-                        {"end_date": ""}
-                    ]
-                }
-            ]
-        }).to_list(1000)
-        
-        result = []
-        for tenant in active_tenants:
-            # Get property info
-            property_data = await db.properties.find_one({"id": tenant.get("property_id")})
-            
-            # Get unit info if exists
-            unit_data = None
-            if tenant.get("unit_id"):
-                unit_data = await db.units.find_one({"id": tenant["unit_id"]})
-            
-            result.append({
-                "tenant_id": tenant["id"],
-                "tenant_name": tenant["name"],
-                "tenant_phone": tenant.get("phone", "Non renseigné"),
-                "property_name": property_data["address"] if property_data else "Inconnue",
-                "unit_number": unit_data["unit_number"] if unit_data else "Non spécifié",
-                "unit_type": unit_data["unit_type"] if unit_data else "Non spécifié",
-                "start_date": tenant.get("start_date"),
-                "end_date": tenant.get("end_date"),
-                "monthly_rent": tenant.get("monthly_rent", 0),
-                "months_paid": tenant.get("months_paid", 0)
-            })
+    day = parse_day(date)
+    if day is None:
+        raise HTTPException(status_code=400, detail=f"Format de date invalide: {date}")
+    
+    # Intervalles contenant la date, avec les infos à jour du locataire et de l'unité
+    occupants = await db.occupancy_intervals.aggregate([
+        {"$match": {"start": {"$lte": day}, "end": {"$gte": day}}},
+        {"$lookup": {
+            "from": "tenants",
+            "localField": "tenant_id",
+            "foreignField": "id",
+            "as": "tenant"
+        }},
+        {"$lookup": {
+            "from": "units",
+            "localField": "unit_id",
+            "foreignField": "id",
+            "as": "unit"
+        }},
+        {"$project": {
+            "_id": 0,
+            "tenant_id": 1,
+            "tenant_name": 1,
+            "property_name": 1,
+            "unit_id": 1,
+            "unit_number": 1,
+            "monthly_rent": 1,
+            "start": 1,
+            "end": 1,
+            "tenant": {"$arrayElemAt": ["$tenant", 0]},
+            "unit": {"$arrayElemAt": ["$unit", 0]}
+        }}
+    ]).to_list(None)
+    
+    result = []
+    for interval in occupants:
+        tenant = interval.pop("tenant", None) or {}
+        unit_data = interval.pop("unit", None) if interval.get("unit_id") else None
+        interval = format_interval(interval)
         
-        return {"date": date, "occupants": result}
+        result.append({
+            "tenant_id": interval["tenant_id"],
+            "tenant_name": tenant.get("name", interval["tenant_name"]),
+            "tenant_phone": tenant.get("phone", "Non renseigné"),
+            "property_name": interval.get("property_name") or "Inconnue",
+            "unit_number": interval.get("unit_number") or "Non spécifié",
+            "unit_type": unit_data["unit_type"] if unit_data else "Non spécifié",
+            "start_date": interval["start_date"],
+            "end_date": interval["end_date"],
+            "monthly_rent": interval.get("monthly_rent", 0),
+            "months_paid": tenant.get("months_paid", 0)
+        })
     
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Format de date invalide: {str(e)}")
+    return {"date": date, "occupants": result}
+
+@api_router.get("/search/occupancy-range")
+async def search_occupancy_between(start: str, end: str):
+    """Occupations ayant chevauché la période [start, end]"""
+    start_day, end_day = parse_day(start), parse_day(end)
+    if start_day is None or end_day is None or start_day > end_day:
+        raise HTTPException(status_code=400, detail="Période invalide")
+    
+    intervals = await db.occupancy_intervals.find(
+        {"start": {"$lte": end_day}, "end": {"$gte": start_day}}
+    ).sort("start", ASCENDING).to_list(None)
+    return {"start": start, "end": end, "occupancies": [format_interval(i) for i in intervals]}
+
+@api_router.post("/search/occupancy/rebuild")
+async def rebuild_occupancy_index(current_admin: User = Depends(get_admin_user)):
+    """Reconstruire l'index d'occupation depuis l'historique"""
+    return await rebuild_occupancy_intervals()
 
 @api_router.get("/search/unit-history/{unit_id}")
-async def get_unit_occupancy_history(unit_id: str):
+async def get_unit_occupancy_history(unit_id: str, request: Request, stream: bool = False):
     """Historique des occupants d'une unité spécifique"""
+    if wants_stream(request, stream):
+        cursor = db.tenant_history.find({"unit_id": unit_id}).sort("start_date", -1)
+        return stream_documents(cursor, request)
     history = await db.tenant_history.find({"unit_id": unit_id}).sort("start_date", -1).to_list(1000)
     return [TenantHistory(**h) for h in history]
 
 # Backup/Restore endpoints
+BACKUP_COLLECTIONS = ["properties", "units", "tenants", "payments", "receipts", "tenant_history"]
+
+async def _backup_json_stream():
+    """The backup document, written collection by collection"""
+    yield f'{{"backup_date": "{datetime.now().isoformat()}", "app_version": "2.0"'
+    total_records = {}
+    for name in BACKUP_COLLECTIONS:
+        yield f', "{name}": '
+        count = 0
+        async for document in db[name].find().batch_size(STREAM_BATCH_SIZE):
+            yield ("," if count else "[") + dump_document(document)
+            count += 1
+        yield "]" if count else "[]"
+        total_records[name] = count
+    settings = await db.settings.find_one({})
+    yield ', "settings": ' + (dump_document(settings) if settings else "{}")
+    yield ', "total_records": ' + json.dumps(total_records) + "}"
+
+async def _backup_ndjson_stream():
+    for name in BACKUP_COLLECTIONS + ["settings"]:
+        async for document in db[name].find().batch_size(STREAM_BATCH_SIZE):
+            document.pop("_id", None)
+            yield dump_document({"collection": name, "document": document}) + "\n"
+
 @api_router.get("/backup")
-async def backup_data():
+async def backup_data(request: Request):
     """Export all application data as JSON"""
-    try:
-        # Get all data
-        properties = await db.properties.find().to_list(1000)
-        units = await db.units.find().to_list(1000)
-        tenants = await db.tenants.find().to_list(1000)
-        payments = await db.payments.find().to_list(1000)
-        receipts = await db.receipts.find().to_list(1000)
-        tenant_history = await db.tenant_history.find().to_list(1000)
-        settings = await db.settings.find_one({})
-        
-        # Create backup data
-        backup_data = {
-            "backup_date": datetime.now().isoformat(),
-            "app_version": "2.0",
-            "properties": properties,
-            "units": units,
-            "tenants": tenants,
-            "payments": payments,
-            "receipts": receipts,
-            "tenant_history": tenant_history,
-            "settings": settings or {},
-            "total_records": {
-                "properties": len(properties),
-                "units": len(units),
-                "tenants": len(tenants),
-                "payments": len(payments),
-                "receipts": len(receipts),
-                "tenant_history": len(tenant_history)
-            }
-        }
-        
-        return backup_data
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erreur lors de la sauvegarde: {str(e)}")
+    if wants_ndjson(request):
+        return StreamingResponse(_backup_ndjson_stream(), media_type=NDJSON_MEDIA_TYPE)
+    return StreamingResponse(_backup_json_stream(), media_type="application/json")
+
+RESTORE_BATCH_SIZE = 1000
+
+def _restorable(document: dict) -> dict:
+    document.pop("_id", None)
+    # JSON backups carry datetimes as ISO strings, store them back as dates
+    for field in ("created_at", "updated_at"):
+        if isinstance(document.get(field), str):
+            try:
+                document[field] = datetime.fromisoformat(document[field])
+            except ValueError:
+                pass
+    return document
+
+async def restore_collection(name: str, documents, replace: bool = False) -> dict:
+    """Insert the documents whose `id` is not already present, in unordered batches.
+
+    With replace=True (incremental archives) existing documents are overwritten
+    by the archived version instead of being skipped.
+    """
+    collection = db[name]
+    stats = {"inserted": 0, "updated": 0, "skipped": 0, "invalid": 0, "errors": 0}
+    matched_key = "updated" if replace else "skipped"
+    started = time.perf_counter()
+
+    async def flush(operations):
+        try:
+            result = await collection.bulk_write(operations, ordered=False)
+            stats["inserted"] += result.upserted_count
+            stats[matched_key] += result.matched_count
+        except BulkWriteError as e:
+            stats["inserted"] += e.details.get("nUpserted", 0)
+            stats[matched_key] += e.details.get("nMatched", 0)
+            stats["errors"] += len(e.details.get("writeErrors", []))
+
+    operations = []
+    for document in documents:
+        if not isinstance(document, dict) or not document.get("id"):
+            stats["invalid"] += 1
+            continue
+        document = _restorable(document)
+        if replace:
+            operations.append(ReplaceOne({"id": document["id"]}, document, upsert=True))
+        else:
+            operations.append(UpdateOne({"id": document["id"]}, {"$setOnInsert": document}, upsert=True))
+        if len(operations) >= RESTORE_BATCH_SIZE:
+            await flush(operations)
+            operations = []
+    if operations:
+        await flush(operations)
+
+    elapsed = time.perf_counter() - started
+    processed = stats["inserted"] + stats["updated"] + stats["skipped"]
+    stats["duration_ms"] = round(elapsed * 1000, 1)
+    stats["documents_per_second"] = round(processed / elapsed) if elapsed > 0 else processed
+    return stats
+
+async def restore_settings(settings: dict):
+    settings.pop("_id", None)
+    settings.pop("id", None)
+    if not settings:
+        return
+    await ensure_settings_document()
+    settings_cache.set(await update_by_id(db.settings, SETTINGS_ID, settings))
 
 @api_router.post("/restore")
 async def restore_data(backup_data: dict):
     """Restore all application data from JSON backup"""
     try:
-        # Clear existing data (optional - can be made configurable)
-        # await db.properties.delete_many({})
-        # await db.tenants.delete_many({})
-        # await db.payments.delete_many({})
-        # await db.receipts.delete_many({})
+        # Collections are independent (documents only reference each other by id),
+        # so they are restored concurrently
+        names = [name for name in BACKUP_COLLECTIONS if backup_data.get(name)]
+        results = await asyncio.gather(*(restore_collection(name, backup_data[name]) for name in names))
+        collections = dict(zip(names, results))
         
-        # Restore properties
-        if "properties" in backup_data and backup_data["properties"]:
-            for prop in backup_data["properties"]:
-                # Remove MongoDB _id if present
-                prop.pop("_id", None)
-                existing = await db.properties.find_one({"id": prop["id"]})
-                if not existing:
-                    await db.properties.insert_one(prop)
-        
-        # Restore units
-        if "units" in backup_data and backup_data["units"]:
-            for unit in backup_data["units"]:
-                unit.pop("_id", None)
-                existing = await db.units.find_one({"id": unit["id"]})
-                if not existing:
-                    await db.units.insert_one(unit)
-        
-        # Restore tenant history
-        if "tenant_history" in backup_data and backup_data["tenant_history"]:
-            for history in backup_data["tenant_history"]:
-                history.pop("_id", None)
-                existing = await db.tenant_history.find_one({"id": history["id"]})
-                if not existing:
-                    await db.tenant_history.insert_one(history)
-        
-        # Restore tenants
-        if "tenants" in backup_data and backup_data["tenants"]:
-            for tenant in backup_data["tenants"]:
-                tenant.pop("_id", None)
-                existing = await db.tenants.find_one({"id": tenant["id"]})
-                if not existing:
-                    await db.tenants.insert_one(tenant)
-        
-        # Restore payments
-        if "payments" in backup_data and backup_data["payments"]:
-            for payment in backup_data["payments"]:
-                payment.pop("_id", None)
-                existing = await db.payments.find_one({"id": payment["id"]})
-                if not existing:
-                    await db.payments.insert_one(payment)
+        # Restore settings
+        if backup_data.get("settings"):
+            await restore_settings(backup_data["settings"])
         
-        # Restore receipts
-        if "receipts" in backup_data and backup_data["receipts"]:
-            for receipt in backup_data["receipts"]:
-                receipt.pop("_id", None)
-                existing = await db.receipts.find_one({"id": receipt["id"]})
-                if not existing:
-                    await db.receipts.insert_one(receipt)
+        # Restored documents bypass the write paths, recount everything
+        await rebuild_dashboard_stats()
+        await rebuild_occupancy_intervals()
+        await invalidate_rollups(None)
+        await settle_ledger()
         
-        # Restore settings
-        if "settings" in backup_data and backup_data["settings"]:
-            settings = backup_data["settings"]
-            settings.pop("_id", None)
-            if settings:
-                existing = await db.settings.find_one({})
-                if existing:
-                    await db.settings.update_one(
-                        {"id": existing["id"]},
-                        {"$set": settings}
-                    )
-                else:
-                    await db.settings.insert_one(settings)
+        for name, stats in collections.items():
+            logger.info(
+                f"Restauration {name}: {stats['inserted']} insérés, {stats['skipped']} existants, "
+                f"{stats['documents_per_second']} docs/s"
+            )
         
         return {
             "message": "Données restaurées avec succès",
             "restored_records": backup_data.get("total_records", {}),
+            "collections": collections,
             "restore_date": datetime.now().isoformat()
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erreur lors de la restauration: {str(e)}")
 
+# Backup archives
+# An archive is a gzip-compressed NDJSON stream: a header line, one
+# {"collection", "document"} line per document, then a manifest line with the
+# per-collection counts. Documents are encoded with bson.json_util so dates and
+# other BSON types survive the round-trip. An archive without its manifest
+# line was cut short.
+#
+# Incremental archives only hold the documents whose `updated_at` is after
+# `since`, plus {"type": "deletion"} lines for the ids deleted meanwhile. Every
+# archive records the `watermark` it was taken at; the next incremental starts
+# from it (minus WATERMARK_OVERLAP to absorb clock skew between workers,
+# replaying a document twice is harmless).
+ARCHIVE_FORMAT = "location-backup"
+ARCHIVE_VERSION = 2
+ARCHIVE_COLLECTIONS = BACKUP_COLLECTIONS + ["settings"]
+WATERMARK_OVERLAP = timedelta(minutes=5)
+
+def archive_line(record: dict) -> bytes:
+    line = json_util.dumps(record, json_options=json_util.RELAXED_JSON_OPTIONS, ensure_ascii=False)
+    return (line + "\n").encode("utf-8")
+
+async def archive_records(since: Optional[datetime] = None, watermark: Optional[datetime] = None):
+    watermark = watermark or datetime.utcnow()
+    query = {"updated_at": {"$gte": since - WATERMARK_OVERLAP}} if since else {}
+    yield {
+        "type": "header",
+        "format": ARCHIVE_FORMAT,
+        "version": ARCHIVE_VERSION,
+        "app_version": "2.0",
+        "mode": "incremental" if since else "full",
+        "since": since,
+        "watermark": watermark,
+        "backup_date": datetime.utcnow(),
+        "collections": ARCHIVE_COLLECTIONS
+    }
+    total_records = {}
+    for name in ARCHIVE_COLLECTIONS:
+        count = 0
+        async for document in db[name].find(query).batch_size(STREAM_BATCH_SIZE):
+            document.pop("_id", None)
+            yield {"collection": name, "document": document}
+            count += 1
+        total_records[name] = count
+
+    deletions = 0
+    if since:
+        cursor = db.deletions.find({"deleted_at": {"$gte": since - WATERMARK_OVERLAP}})
+        async for deletion in cursor.batch_size(STREAM_BATCH_SIZE):
+            yield {"type": "deletion", "collection": deletion["collection"], "id": deletion["id"]}
+            deletions += 1
+    yield {
+        "type": "manifest",
+        "total_records": total_records,
+        "deletions": deletions,
+        "completed_at": datetime.utcnow()
+    }
+
+async def archive_chunks(since: Optional[datetime] = None, watermark: Optional[datetime] = None):
+    """Compressed archive bytes, produced as the cursors are read"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: gzip container
+    async for record in archive_records(since, watermark):
+        chunk = compressor.compress(archive_line(record))
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+async def last_backup_watermark() -> Optional[datetime]:
+    last_run = await db.backup_runs.find_one({}, sort=[("watermark", DESCENDING)])
+    return last_run["watermark"] if last_run else None
+
+async def record_backup_run(mode: str, since: Optional[datetime], watermark: datetime, location: str):
+    await db.backup_runs.insert_one({
+        "id": str(uuid.uuid4()),
+        "mode": mode,
+        "since": since,
+        "watermark": watermark,
+        "location": location,
+        "completed_at": datetime.utcnow()
+    })
+
+def _merge_restore_stats(total: dict, stats: dict):
+    for key in ("inserted", "updated", "skipped", "invalid", "errors", "duration_ms"):
+        total[key] = total.get(key, 0) + stats[key]
+    processed = total["inserted"] + total["updated"] + total["skipped"]
+    seconds = total["duration_ms"] / 1000
+    total["documents_per_second"] = round(processed / seconds) if seconds > 0 else processed
+
+def read_archive_header(lines) -> dict:
+    for raw in lines:
+        if raw.strip():
+            header = json_util.loads(raw)
+            if header.get("type") != "header" or header.get("format") != ARCHIVE_FORMAT:
+                raise ValueError("Format d'archive inconnu")
+            return header
+    raise ValueError("Archive vide")
+
+async def restore_archive(lines) -> dict:
+    """Replay an archive given as an iterable of raw NDJSON lines (already decompressed)"""
+    lines = iter(lines)
+    header = read_archive_header(lines)
+    replace = header.get("mode") == "incremental"
+    manifest = None
+    collections = {}
+    batches = {}
+    deletions = {}
+
+    async def flush(name):
+        if batches.get(name):
+            stats = await restore_collection(name, batches[name], replace=replace)
+            _merge_restore_stats(collections.setdefault(name, {}), stats)
+            batches[name] = []
+
+    truncated = False
+    try:
+        try:
+            for raw in lines:
+                if not raw.strip():
+                    continue
+                record = json_util.loads(raw)
+                if record.get("type") == "manifest":
+                    manifest = record
+                    continue
+                if record.get("type") == "deletion":
+                    if record.get("collection") in BACKUP_COLLECTIONS:
+                        deletions.setdefault(record["collection"], []).append(record["id"])
+                    continue
+
+                name = record.get("collection")
+                if name == "settings":
+                    await restore_settings(record["document"])
+                elif name in BACKUP_COLLECTIONS:
+                    batches.setdefault(name, []).append(record["document"])
+                    if len(batches[name]) >= RESTORE_BATCH_SIZE:
+                        await flush(name)
+        except (EOFError, zlib.error) as e:
+            # Truncated or corrupt compressed stream: what was read is kept,
+            # as for an archive without its manifest
+            logger.warning(f"Archive tronquée: {e}")
+            truncated = True
+
+        for name in list(batches):
+            await flush(name)
+
+        deleted = {}
+        for name, ids in deletions.items():
+            for offset in range(0, len(ids), RESTORE_BATCH_SIZE):
+                result = await db[name].delete_many({"id": {"$in": ids[offset:offset + RESTORE_BATCH_SIZE]}})
+                deleted[name] = deleted.get(name, 0) + result.deleted_count
+    finally:
+        # Whatever part was restored bypassed the write paths
+        await rebuild_dashboard_stats()
+        await rebuild_occupancy_intervals()
+        await invalidate_rollups(None)
+        await settle_ledger()
+    return {
+        "mode": header.get("mode", "full"),
+        "since": header["since"].isoformat() if header.get("since") else None,
+        "watermark": header["watermark"].isoformat() if header.get("watermark") else None,
+        "backup_date": header["backup_date"].isoformat(),
+        "complete": manifest is not None and not truncated,
+        "total_records": manifest["total_records"] if manifest else {},
+        "collections": collections,
+        "deleted": deleted
+    }
+
+@api_router.get("/backup/archive")
+async def backup_archive(since: Optional[datetime] = None):
+    """Télécharger une archive compressée (NDJSON gzip), complète ou depuis `since`"""
+    suffix = "-incremental" if since else ""
+    filename = f"gestion-location-{datetime.now().strftime('%Y%m%d-%H%M%S')}{suffix}.ndjson.gz"
+    return StreamingResponse(
+        archive_chunks(since=since),
+        media_type="application/gzip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@api_router.post("/restore/archive")
+async def restore_from_archive(file: UploadFile = File(...)):
+    """Restaurer une archive produite par /backup/archive ou backup_db.py"""
+    try:
+        with gzip.GzipFile(fileobj=file.file) as archive:
+            result = await restore_archive(archive)
+    except (OSError, ValueError, EOFError, zlib.error) as e:
+        raise HTTPException(status_code=400, detail=f"Archive invalide: {str(e)}")
+    return {"message": "Archive restaurée", **result, "restore_date": datetime.now().isoformat()}
+
 # Dashboard endpoint
 @api_router.get("/dashboard", response_model=DashboardStats)
 async def get_dashboard_stats():
-    # Get app settings for currency
-    settings = await db.settings.find_one({})
-    if not settings:
-        settings = AppSettings().dict()
-        await db.settings.insert_one(settings)
-    
+    settings = await settings_cache.get()
     currency = settings.get("currency", "EUR")
     currency_symbol = CURRENCY_SYMBOLS.get(currency, "€")
     
-    # Get counts
-    total_properties = await db.properties.count_documents({})
-    total_units = await db.units.count_documents({})
-    total_tenants = await db.tenants.count_documents({})
-    
     # Get current month/year
     current_date = datetime.now()
-    current_month = current_date.month
-    current_year = current_date.year
+    month_id = month_stats_id(current_date.year, current_date.month)
     
-    # Get payments for current month
-    current_month_payments = await db.payments.find({
-        "month": current_month,
-        "year": current_year
-    }).to_list(1000)
+    # Portfolio totals and current month counters, maintained on every write
+    counters = await db.dashboard_stats.find({"id": {"$in": [DASHBOARD_TOTALS_ID, month_id]}}).to_list(2)
+    counters = {doc["id"]: doc for doc in counters}
+    if DASHBOARD_TOTALS_ID not in counters:
+        await rebuild_dashboard_stats()
+        counters = await db.dashboard_stats.find({"id": {"$in": [DASHBOARD_TOTALS_ID, month_id]}}).to_list(2)
+        counters = {doc["id"]: doc for doc in counters}
     
-    # Calculate stats
-    monthly_revenue = sum(p.get("amount", 0) for p in current_month_payments if p.get("status") == "payé")
-    pending_payments = len([p for p in current_month_payments if p.get("status") == "en_attente"])
-    overdue_payments = len([p for p in current_month_payments if p.get("status") == "en_retard"])
+    totals = counters[DASHBOARD_TOTALS_ID]
+    month_stats = counters.get(month_id, {})
+    status_counts = month_stats.get("status_counts", {})
     
-    # Calculate occupancy rate based on units
-    occupied_units = await db.units.count_documents({"status": "occupé"})
+    total_units = totals.get("units", 0)
+    occupied_units = totals.get("occupied_units", 0)
     occupancy_rate = (occupied_units / total_units * 100) if total_units > 0 else 0
     
     return DashboardStats(
-        total_properties=total_properties,
+        total_properties=totals.get("properties", 0),
         total_units=total_units,
-        total_tenants=total_tenants,
+        total_tenants=totals.get("tenants", 0),
         occupied_units=occupied_units,
-        monthly_revenue=monthly_revenue,
-        pending_payments=pending_payments,
-        overdue_payments=overdue_payments,
+        monthly_revenue=month_stats.get("revenue", 0),
+        pending_payments=status_counts.get(PaymentStatus.pending.name, 0),
+        overdue_payments=status_counts.get(PaymentStatus.overdue.name, 0),
         occupancy_rate=round(occupancy_rate, 2),
         currency=currency,
         currency_symbol=currency_symbol
     )
 
+# Analytics endpoints
+MONTH_PATTERN = r"^\d{4}-\d{2}$"
+
+@api_router.get("/analytics/revenue")
+async def get_revenue_analytics(
+    group_by: AnalyticsGroupBy = AnalyticsGroupBy.property,
+    start: Optional[str] = Query(None, pattern=MONTH_PATTERN),
+    end: Optional[str] = Query(None, pattern=MONTH_PATTERN)
+):
+    """Revenus encaissés par mois et par propriété, unité ou moyen de paiement"""
+    start_month, end_month = analytics_period(start, end)
+    figures = await monthly_payment_figures(group_by, start_month, end_month)
+    currency, currency_symbol = await get_receipt_currency()
+    return {
+        "group_by": group_by.value,
+        "currency": currency,
+        "currency_symbol": currency_symbol,
+        "months": [
+            {
+                "year": year,
+                "month": month,
+                "revenue": sum(row["collected"] for row in rows),
+                "groups": [
+                    {"key": row["key"], "revenue": row["collected"], "paid_payments": row["paid_payments"]}
+                    for row in rows
+                ]
+            }
+            for (year, month), rows in figures.items()
+        ]
+    }
+
+@api_router.get("/analytics/collection-rate")
+async def get_collection_rate_analytics(
+    group_by: AnalyticsGroupBy = AnalyticsGroupBy.property,
+    start: Optional[str] = Query(None, pattern=MONTH_PATTERN),
+    end: Optional[str] = Query(None, pattern=MONTH_PATTERN)
+):
+    """Taux d'encaissement (montant payé / montant attendu) par mois"""
+    def rate(collected, expected):
+        return round(collected / expected * 100, 2) if expected else None
+
+    start_month, end_month = analytics_period(start, end)
+    figures = await monthly_payment_figures(group_by, start_month, end_month)
+    months = []
+    for (year, month), rows in figures.items():
+        expected = sum(row["expected"] for row in rows)
+        collected = sum(row["collected"] for row in rows)
+        months.append({
+            "year": year,
+            "month": month,
+            "expected": expected,
+            "collected": collected,
+            "collection_rate": rate(collected, expected),
+            "groups": [
+                {
+                    "key": row["key"],
+                    "expected": row["expected"],
+                    "collected": row["collected"],
+                    "overdue": row["overdue"],
+                    "payments": row["payments"],
+                    "paid_payments": row["paid_payments"],
+                    "collection_rate": rate(row["collected"], row["expected"])
+                }
+                for row in rows
+            ]
+        })
+    return {"group_by": group_by.value, "months": months}
+
+@api_router.get("/analytics/arrears-aging")
+async def get_arrears_aging(group_by: AnalyticsGroupBy = AnalyticsGroupBy.property):
+    """Impayés échus, par ancienneté (jours de retard depuis l'échéance)"""
+    today = datetime.utcnow().date()
+    cutoffs = [((today - timedelta(days=days)).strftime("%Y-%m-%d"), bucket) for days, bucket in ARREARS_BUCKETS]
+    groups = await db.payments.aggregate([
+        {"$match": {
+            "status": {"$in": [PaymentStatus.pending.value, PaymentStatus.overdue.value]},
+            "due_date": {"$lt": today.strftime("%Y-%m-%d")}
+        }},
+        {"$group": {
+            "_id": {
+                "key": f"${group_by.value}",
+                "bucket": {"$switch": {
+                    "branches": [{"case": {"$gte": ["$due_date", cutoff]}, "then": bucket} for cutoff, bucket in cutoffs],
+                    "default": ARREARS_OLDEST_BUCKET
+                }}
+            },
+            "amount": {"$sum": "$amount"},
+            "payments": {"$sum": 1}
+        }}
+    ]).to_list(None)
+
+    bucket_names = [bucket for _, bucket in ARREARS_BUCKETS] + [ARREARS_OLDEST_BUCKET]
+    by_key = {}
+    for group in groups:
+        row = by_key.setdefault(group["_id"].get("key"), {
+            "key": group["_id"].get("key"),
+            "total": 0,
+            "buckets": {bucket: {"amount": 0, "payments": 0} for bucket in bucket_names}
+        })
+        row["buckets"][group["_id"]["bucket"]] = {"amount": group["amount"], "payments": group["payments"]}
+        row["total"] += group["amount"]
+    rows = sorted(by_key.values(), key=lambda row: -row["total"])
+    return {
+        "group_by": group_by.value,
+        "as_of": today.isoformat(),
+        "total": sum(row["total"] for row in rows),
+        "buckets": {
+            bucket: sum(row["buckets"][bucket]["amount"] for row in rows) for bucket in bucket_names
+        },
+        "groups": rows
+    }
+
+# Reports endpoints
+@api_router.get("/reports/portfolio")
+async def export_portfolio_report(
+    report_format: str = Query("csv", alias="format", pattern="^(csv|xlsx|parquet)$"),
+    level: str = Query("tenant", pattern="^(tenant|property)$"),
+    start: Optional[str] = Query(None, pattern=MONTH_PATTERN),
+    end: Optional[str] = Query(None, pattern=MONTH_PATTERN)
+):
+    """Relevé propriétaires : soldes, impayés et taux d'occupation par locataire et par propriété"""
+    start_month, end_month = analytics_period(start, end)
+    report, summary = await build_portfolio_report(start_month, end_month)
+    content = await asyncio.to_thread(export_report, report, summary, report_format, level)
+    period = f"{analytics_month_id(*start_month)}_{analytics_month_id(*end_month)}"
+    filename = f"releve-{level if report_format != 'xlsx' else 'portefeuille'}-{period}.{report_format}"
+    return Response(
+        content=content,
+        media_type=REPORT_FORMATS[report_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+# Periodic jobs, each run by run_leased_job: name -> interval, job, message of a manual run
+async def period_close_status() -> dict:
+    return {"stale_periods": await db.accounting_periods.count_documents({"stale_since": {"$exists": True}})}
+
+LEASED_JOBS = {
+    "overdue-sweeper": {
+        "interval": OVERDUE_SWEEP_INTERVAL_SECONDS,
+        "job": sweep_overdue_payments,
+        "message": "Paiements en retard mis à jour"
+    },
+    "period-close": {
+        "interval": PERIOD_CLOSE_INTERVAL_SECONDS,
+        "job": close_periods,
+        "message": "Clôture mensuelle effectuée",
+        "status": period_close_status
+    },
+    "ledger-verifier": {
+        "interval": LEDGER_VERIFY_INTERVAL_SECONDS,
+        "job": verify_ledger,
+        "message": "Grand livre vérifié"
+    },
+}
+
+def leased_job(name: str) -> dict:
+    if name not in LEASED_JOBS:
+        raise HTTPException(status_code=404, detail="Tâche inconnue")
+    return LEASED_JOBS[name]
+
+@api_router.get("/jobs/{name}")
+async def get_job_status(name: str, current_admin: User = Depends(get_admin_user)):
+    job = leased_job(name)
+    lease = await db.leases.find_one({"id": name}, {"_id": 0})
+    status = lease or {"id": name, "last_run_at": None}
+    if "status" in job:
+        status.update(await job["status"]())
+    return status
+
+@api_router.post("/jobs/{name}")
+async def run_job_now(name: str, current_admin: User = Depends(get_admin_user)):
+    """Lancer maintenant une tâche périodique (retards, clôture mensuelle, grand livre)"""
+    job = leased_job(name)
+    started = time.perf_counter()
+    result = await job["job"]()
+    return {"message": job["message"], **result, "duration_ms": round((time.perf_counter() - started) * 1000, 1)}
+
+@api_router.post("/dashboard/rebuild")
+async def rebuild_dashboard(current_admin: User = Depends(get_admin_user)):
+    """Recalculer les compteurs du tableau de bord"""
+    started = time.perf_counter()
+    result = await rebuild_dashboard_stats()
+    return {"message": "Compteurs recalculés", **result, "duration_ms": round((time.perf_counter() - started) * 1000, 1)}
+
 # Include the router in the main app
 app.include_router(api_router)
 
@@ -1027,6 +3666,7 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Configure logging
@@ -1036,6 +3676,28 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def startup_db_client():
+    drop_undeclared = os.environ.get("INDEX_DROP_UNDECLARED", "false").lower() == "true"
+    if "receipt_number_1" not in await db.receipts.index_information():
+        # Until the unique index exists, older receipts may share a number
+        await renumber_duplicate_receipts()
+    await ensure_indexes(drop_undeclared=drop_undeclared)
+    if await db.occupancy_intervals.estimated_document_count() == 0:
+        await rebuild_occupancy_intervals()
+    settings_cache.set(await ensure_settings_document())
+    if await db.ledger_entries.estimated_document_count() == 0:
+        # The first worker to take the lease posts the opening balances, the
+        # others find the ledger no longer empty
+        await settle_ledger("opening_balance", wait=False, only_if_empty=True)
+    for name, job in LEASED_JOBS.items():
+        background_tasks.append(asyncio.create_task(run_leased_job(name, job["interval"], job["job"])))
+    background_tasks.append(asyncio.create_task(watch_settings()))
+    background_tasks.append(asyncio.create_task(watch_users()))
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    for task in background_tasks:
+        task.cancel()
+    client.close()
+    password_executor.shutdown(wait=False)
\ No newline at end of file
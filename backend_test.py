@@ -7,6 +7,7 @@ import sys
 import os
 from dotenv import load_dotenv
 import time
+import gzip
 
 # Load environment variables from frontend/.env to get the backend URL
 load_dotenv("/app/frontend/.env")
@@ -67,6 +68,15 @@ def print_response(response, message=""):
     except:
         print(response.text)
 
+def admin_headers():
+    """Bearer token for the admin-only endpoints (jobs, users)"""
+    response = requests.post(f"{API_URL}/auth/login", json={
+        "username": os.environ.get("ADMIN_USERNAME", "admin"),
+        "password": os.environ.get("ADMIN_PASSWORD", "admin123")
+    })
+    assert response.status_code == 200, "Admin login failed (set ADMIN_USERNAME / ADMIN_PASSWORD)"
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
 # Test functions
 def test_properties_api():
     print_separator()
@@ -655,6 +665,559 @@ def test_receipts_api(tenants, payments):
     print("\n✅ Receipts API tests passed successfully")
     return created_receipts
 
+def test_receipts_batch_api(payments, receipts):
+    print_separator()
+    print("TESTING RECEIPTS BATCH API")
+    print_separator()
+    
+    # Payments that already have a receipt are reported, not issued twice
+    fake_id = str(uuid.uuid4())
+    payment_ids = [receipt["payment_id"] for receipt in receipts] + [payments[-1]["id"], fake_id]
+    response = requests.post(f"{API_URL}/receipts/batch", json={"payment_ids": payment_ids})
+    print_response(response, "POST /receipts/batch:")
+    assert response.status_code == 200, "Failed to create receipts batch"
+    
+    result = response.json()
+    assert result["requested"] == len(payment_ids), "Batch did not report every payment"
+    items = {item["payment_id"]: item for item in result["items"]}
+    for receipt in receipts:
+        assert items[receipt["payment_id"]]["status"] == "exists", "Existing receipt was issued again"
+    assert items[fake_id]["status"] == "error", "Unknown payment should be reported as an error"
+    assert items[payments[-1]["id"]]["status"] in ("created", "exists"), "Batch receipt was not created"
+    
+    # Receipt numbers must stay unique
+    response = requests.get(f"{API_URL}/receipts", params={"limit": 1000})
+    numbers = [receipt["receipt_number"] for receipt in response.json()]
+    assert len(numbers) == len(set(numbers)), "Duplicate receipt numbers"
+    
+    # Neither payment_ids nor month/year
+    response = requests.post(f"{API_URL}/receipts/batch", json={})
+    assert response.status_code == 400, "Empty batch request should be rejected"
+    
+    print("\n✅ Receipts batch API tests passed successfully")
+
+def test_mark_paid_api(tenants):
+    print_separator()
+    print("TESTING MARK-PAID API")
+    print_separator()
+    
+    # Fresh pending payments next year, so that earlier tests' figures are untouched
+    tenant = tenants[0]
+    year = datetime.now().year + 1
+    created_payments = []
+    for month in (1, 2):
+        response = requests.post(f"{API_URL}/payments", json={
+            "tenant_id": tenant["id"],
+            "property_id": tenant["property_id"],
+            "month": month,
+            "year": year,
+            "amount": tenant["monthly_rent"],
+            "due_date": f"{year}-{month:02d}-05",
+            "status": "en_attente"
+        })
+        assert response.status_code == 200, "Failed to create payment"
+        created_payments.append(response.json())
+    
+    def months_paid():
+        return requests.get(f"{API_URL}/tenants/{tenant['id']}").json()["months_paid"]
+    
+    # Marking the same payment paid twice counts the month once
+    before = months_paid()
+    payment_id = created_payments[0]["id"]
+    for attempt in (1, 2):
+        response = requests.put(f"{API_URL}/payments/{payment_id}/mark-paid")
+        print_response(response, f"PUT /payments/{payment_id}/mark-paid (attempt {attempt}):")
+        assert response.status_code == 200, "Failed to mark payment as paid"
+        assert response.json()["status"] == "payé", "Payment status not updated to paid"
+    assert months_paid() == before + 1, "Marking a payment paid twice counted the month twice"
+    
+    response = requests.put(f"{API_URL}/payments/{uuid.uuid4()}/mark-paid")
+    assert response.status_code == 404, "Unknown payment should return 404"
+    
+    # Bulk: one pending, one already paid, one unknown, one duplicate id
+    fake_id = str(uuid.uuid4())
+    pending_id = created_payments[1]["id"]
+    response = requests.post(f"{API_URL}/payments/mark-paid", json={
+        "payment_ids": [pending_id, payment_id, fake_id, pending_id]
+    })
+    print_response(response, "POST /payments/mark-paid:")
+    assert response.status_code == 200, "Failed to bulk mark payments as paid"
+    result = response.json()
+    assert result["requested"] == 3, "Duplicate ids should be counted once"
+    assert result["paid"] == 1, "Pending payment was not marked paid"
+    assert result["already_paid"] == 1, "Already paid payment was not reported"
+    assert result["not_found"] == [fake_id], "Unknown payment was not reported"
+    assert months_paid() == before + 2, "Bulk mark-paid counted the wrong number of months"
+    
+    # Running the same batch again changes nothing
+    response = requests.post(f"{API_URL}/payments/mark-paid", json={"payment_ids": [pending_id, payment_id]})
+    result = response.json()
+    assert result["paid"] == 0 and result["already_paid"] == 2, "Second bulk run marked payments again"
+    assert months_paid() == before + 2, "Second bulk run counted months again"
+    
+    for payment in created_payments:
+        requests.delete(f"{API_URL}/payments/{payment['id']}")
+    
+    print("\n✅ Mark-paid API tests passed successfully")
+
+def test_payment_schedule_api(tenants):
+    print_separator()
+    print("TESTING PAYMENT SCHEDULE API")
+    print_separator()
+    
+    # A month in the future: every test tenant's lease covers it
+    schedule = {"month": 6, "year": datetime.now().year + 1, "due_day": 31}
+    response = requests.post(f"{API_URL}/payments/schedule", json=schedule)
+    print_response(response, "POST /payments/schedule:")
+    assert response.status_code == 200, "Failed to generate payment schedule"
+    first = response.json()
+    assert first["active_tenants"] >= len(tenants), "Active tenants missing from the schedule"
+    
+    def scheduled_payments(tenant):
+        payments = requests.get(f"{API_URL}/payments/tenant/{tenant['id']}").json()
+        return [p for p in payments if p["year"] == schedule["year"] and p["month"] == schedule["month"]]
+    
+    for tenant in tenants:
+        payments = scheduled_payments(tenant)
+        assert len(payments) == 1, "Tenant should have exactly one entry for the month"
+        assert payments[0]["status"] == "en_attente", "Scheduled payment should be pending"
+        assert payments[0]["due_date"] == f"{schedule['year']}-06-30", "Due day not clamped to the month"
+        assert payments[0]["amount"] == tenant["monthly_rent"], "Scheduled amount differs from the rent"
+    
+    # Re-running the same month creates nothing
+    response = requests.post(f"{API_URL}/payments/schedule", json=schedule)
+    print_response(response, "POST /payments/schedule (again):")
+    assert response.status_code == 200, "Failed to re-run payment schedule"
+    second = response.json()
+    assert second["created"] == 0, "Re-running the schedule created payments"
+    assert second["existing"] == first["created"] + first["existing"], "Re-run did not find the existing entries"
+    for tenant in tenants:
+        assert len(scheduled_payments(tenant)) == 1, "Re-running the schedule duplicated a payment"
+    
+    response = requests.post(f"{API_URL}/payments/schedule", json={**schedule, "month": 13})
+    assert response.status_code == 422, "Invalid month should be rejected"
+    
+    for tenant in tenants:
+        for payment in scheduled_payments(tenant):
+            requests.delete(f"{API_URL}/payments/{payment['id']}")
+    
+    print("\n✅ Payment schedule API tests passed successfully")
+
+def test_overdue_sweeper_api(tenants):
+    print_separator()
+    print("TESTING OVERDUE SWEEPER JOB")
+    print_separator()
+    
+    # One payment due last year, one due next year: only the first is overdue
+    tenant = tenants[0]
+    year = datetime.now().year + 1
+    created_payments = []
+    for month, due_date in ((3, f"{year - 2}-12-05"), (4, f"{year}-04-05")):
+        response = requests.post(f"{API_URL}/payments", json={
+            "tenant_id": tenant["id"],
+            "property_id": tenant["property_id"],
+            "month": month,
+            "year": year,
+            "amount": tenant["monthly_rent"],
+            "due_date": due_date,
+            "status": "en_attente"
+        })
+        assert response.status_code == 200, "Failed to create payment"
+        created_payments.append(response.json())
+    past_due, not_due = created_payments
+    
+    headers = admin_headers()
+    response = requests.post(f"{API_URL}/jobs/overdue-sweeper", headers=headers)
+    print_response(response, "POST /jobs/overdue-sweeper:")
+    assert response.status_code == 200, "Failed to run the overdue sweeper"
+    assert response.json()["transitioned"] >= 1, "Sweeper transitioned nothing"
+    
+    statuses = {p["id"]: p["status"] for p in requests.get(f"{API_URL}/payments/tenant/{tenant['id']}").json()}
+    assert statuses[past_due["id"]] == "en_retard", "Past-due payment was not moved to overdue"
+    assert statuses[not_due["id"]] == "en_attente", "Payment not yet due was moved to overdue"
+    
+    response = requests.get(f"{API_URL}/jobs/overdue-sweeper", headers=headers)
+    assert response.status_code == 200, "Failed to get the sweeper status"
+    response = requests.post(f"{API_URL}/jobs/not-a-job", headers=headers)
+    assert response.status_code == 404, "Unknown job should return 404"
+    response = requests.post(f"{API_URL}/jobs/overdue-sweeper")
+    assert response.status_code in (401, 403), "Jobs must require an admin token"
+    
+    for payment in created_payments:
+        requests.delete(f"{API_URL}/payments/{payment['id']}")
+    
+    print("\n✅ Overdue sweeper tests passed successfully")
+
+def test_backup_archive_api():
+    print_separator()
+    print("TESTING BACKUP ARCHIVES (full + incremental)")
+    print_separator()
+    
+    created = []
+    for address in ("Backup Test - modifiée ensuite", "Backup Test - supprimée ensuite"):
+        response = requests.post(f"{API_URL}/properties", json={"address": address, "monthly_rent": 700.0})
+        assert response.status_code == 200, "Failed to create property"
+        created.append(response.json())
+    updated, deleted = created
+    
+    def download(params=None):
+        response = requests.get(f"{API_URL}/backup/archive", params=params)
+        print(f"GET /backup/archive {params or ''}: {response.status_code}, {len(response.content)} bytes")
+        assert response.status_code == 200, "Failed to download archive"
+        header = json.loads(gzip.decompress(response.content).splitlines()[0])
+        return response.content, header
+    
+    def restore(content, name):
+        response = requests.post(
+            f"{API_URL}/restore/archive",
+            files={"file": (name, content, "application/gzip")}
+        )
+        print_response(response, f"POST /restore/archive ({name}):")
+        assert response.status_code == 200, "Failed to restore archive"
+        assert response.json()["complete"], "Archive reported as incomplete"
+        return response.json()
+    
+    full, header = download()
+    assert header["mode"] == "full", "First archive should be a full backup"
+    
+    # Changes after the full backup: one update, one deletion
+    response = requests.put(f"{API_URL}/properties/{updated['id']}", json={
+        "address": "Backup Test - modifiée",
+        "monthly_rent": 750.0
+    })
+    assert response.status_code == 200, "Failed to update property"
+    response = requests.delete(f"{API_URL}/properties/{deleted['id']}")
+    assert response.status_code == 200, "Failed to delete property"
+    
+    incremental, incremental_header = download({"since": header["watermark"]["$date"]})
+    assert incremental_header["mode"] == "incremental", "Second archive should be incremental"
+    
+    # Lose the updated property, then restore the chain
+    requests.delete(f"{API_URL}/properties/{updated['id']}")
+    result = restore(full, "full.ndjson.gz")
+    assert result["mode"] == "full", "Full archive restored as incremental"
+    response = requests.get(f"{API_URL}/properties/{updated['id']}")
+    assert response.status_code == 200, "Full restore did not bring the property back"
+    assert response.json()["address"] == updated["address"], "Full restore should hold the original version"
+    assert requests.get(f"{API_URL}/properties/{deleted['id']}").status_code == 200, "Full restore missed a property"
+    
+    result = restore(incremental, "incremental.ndjson.gz")
+    assert result["mode"] == "incremental", "Incremental archive restored as full"
+    response = requests.get(f"{API_URL}/properties/{updated['id']}")
+    assert response.status_code == 200, "Incremental restore lost the updated property"
+    assert response.json()["address"] == "Backup Test - modifiée", "Incremental restore did not replay the update"
+    assert response.json()["monthly_rent"] == 750.0, "Incremental restore did not replay the update"
+    assert requests.get(f"{API_URL}/properties/{deleted['id']}").status_code == 404, "Incremental restore did not apply the deletion"
+    assert result["deleted"].get("properties", 0) >= 1, "Deletion not reported"
+    
+    requests.delete(f"{API_URL}/properties/{updated['id']}")
+    
+    print("\n✅ Backup archive tests passed successfully")
+
+def test_user_deactivation_api():
+    print_separator()
+    print("TESTING USER DEACTIVATION")
+    print_separator()
+    
+    headers = admin_headers()
+    suffix = uuid.uuid4().hex[:8]
+    password = f"secret-{suffix}"
+    response = requests.post(f"{API_URL}/auth/create-user", headers=headers, json={
+        "username": f"viewer-{suffix}",
+        "email": f"viewer-{suffix}@example.com",
+        "full_name": "Lecteur Test",
+        "password": password
+    })
+    print_response(response, "POST /auth/create-user:")
+    assert response.status_code == 200, "Failed to create user"
+    user = response.json()
+    
+    response = requests.post(f"{API_URL}/auth/login", json={"username": user["username"], "password": password})
+    assert response.status_code == 200, "New user could not log in"
+    user_headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    
+    # Cache the user behind the token, then deactivate: the token must stop working at once
+    response = requests.get(f"{API_URL}/auth/me", headers=user_headers)
+    assert response.status_code == 200, "Token rejected before deactivation"
+    response = requests.put(f"{API_URL}/auth/users/{user['id']}/toggle-status", headers=headers)
+    print_response(response, f"PUT /auth/users/{user['id']}/toggle-status:")
+    assert response.status_code == 200, "Failed to deactivate user"
+    response = requests.get(f"{API_URL}/auth/me", headers=user_headers)
+    print_response(response, "GET /auth/me (deactivated):")
+    assert response.status_code == 401, "Deactivated user's token still accepted"
+    response = requests.post(f"{API_URL}/auth/login", json={"username": user["username"], "password": password})
+    assert response.status_code == 401, "Deactivated user could log in"
+    
+    # Reactivating restores the same token
+    requests.put(f"{API_URL}/auth/users/{user['id']}/toggle-status", headers=headers)
+    response = requests.get(f"{API_URL}/auth/me", headers=user_headers)
+    assert response.status_code == 200, "Reactivated user's token still rejected"
+    
+    response = requests.delete(f"{API_URL}/auth/users/{user['id']}", headers=headers)
+    assert response.status_code == 200, "Failed to delete user"
+    response = requests.get(f"{API_URL}/auth/me", headers=user_headers)
+    assert response.status_code == 401, "Deleted user's token still accepted"
+    
+    print("\n✅ User deactivation tests passed successfully")
+
+def test_analytics_api(payments):
+    print_separator()
+    print("TESTING ANALYTICS API")
+    print_separator()
+    
+    months = sorted({(payment["year"], payment["month"]) for payment in payments})
+    start = f"{months[0][0]}-{months[0][1]:02d}"
+    end = f"{months[-1][0]}-{months[-1][1]:02d}"
+    
+    # Revenue per property must include every paid test payment
+    response = requests.get(f"{API_URL}/analytics/revenue", params={"start": start, "end": end, "group_by": "property_id"})
+    print_response(response, "GET /analytics/revenue:")
+    assert response.status_code == 200, "Failed to get revenue analytics"
+    result = response.json()
+    assert len(result["months"]) >= len(months), "Missing months in revenue analytics"
+    revenue = {}
+    for month in result["months"]:
+        for group in month["groups"]:
+            revenue[(month["year"], month["month"], group["key"])] = group["revenue"]
+    for payment in payments:
+        if payment["status"] == "payé":
+            key = (payment["year"], payment["month"], payment["property_id"])
+            assert revenue.get(key, 0) >= payment["amount"], f"Paid payment missing from revenue {key}"
+    
+    # Same figures when served from the closed-month cache
+    response = requests.get(f"{API_URL}/analytics/revenue", params={"start": start, "end": end, "group_by": "property_id"})
+    assert response.json()["months"] == result["months"], "Cached revenue differs from computed revenue"
+    
+    response = requests.get(f"{API_URL}/analytics/collection-rate", params={"start": start, "end": end, "group_by": "payment_method"})
+    print_response(response, "GET /analytics/collection-rate:")
+    assert response.status_code == 200, "Failed to get collection rate analytics"
+    for month in response.json()["months"]:
+        if month["collection_rate"] is not None:
+            assert 0 <= month["collection_rate"] <= 100, "Collection rate out of range"
+    
+    response = requests.get(f"{API_URL}/analytics/arrears-aging", params={"group_by": "unit_id"})
+    print_response(response, "GET /analytics/arrears-aging:")
+    assert response.status_code == 200, "Failed to get arrears aging"
+    aging = response.json()
+    assert set(aging["buckets"]) == {"0-30", "31-60", "61-90", "90+"}, "Unexpected arrears buckets"
+    assert abs(sum(aging["buckets"].values()) - aging["total"]) < 0.01, "Arrears buckets do not add up"
+    
+    # Invalid parameters
+    response = requests.get(f"{API_URL}/analytics/revenue", params={"start": "2024-13"})
+    assert response.status_code == 400, "Invalid month should be rejected"
+    response = requests.get(f"{API_URL}/analytics/revenue", params={"group_by": "tenant_id"})
+    assert response.status_code == 422, "Unknown grouping should be rejected"
+    
+    print("\n✅ Analytics API tests passed successfully")
+
+def test_closed_month_rollups_api(tenants):
+    print_separator()
+    print("TESTING CLOSED-MONTH ROLLUPS")
+    print_separator()
+    
+    # A past month of its own, so that the raw figures only hold this test's payments
+    tenant = tenants[0]
+    year, month = datetime.now().year - 3, 2
+    period = f"{year}-{month:02d}"
+    created_payments = []
+    for status, amount in (("payé", tenant["monthly_rent"]), ("en_attente", tenant["monthly_rent"])):
+        response = requests.post(f"{API_URL}/payments", json={
+            "tenant_id": tenant["id"],
+            "property_id": tenant["property_id"],
+            "month": month,
+            "year": year,
+            "amount": amount,
+            "due_date": f"{period}-05",
+            "status": status
+        })
+        assert response.status_code == 200, "Failed to create payment"
+        created_payments.append(response.json())
+    
+    def raw_figures():
+        figures = {}
+        for payment in requests.get(f"{API_URL}/payments", params={"limit": 1000}).json():
+            if (payment["year"], payment["month"]) != (year, month):
+                continue
+            row = figures.setdefault(payment["property_id"], {"expected": 0, "collected": 0, "payments": 0})
+            row["expected"] += payment["amount"]
+            row["payments"] += 1
+            if payment["status"] == "payé":
+                row["collected"] += payment["amount"]
+        return figures
+    
+    def check_analytics(message):
+        expected = raw_figures()
+        response = requests.get(f"{API_URL}/analytics/collection-rate", params={"start": period, "end": period})
+        assert response.status_code == 200, "Failed to get collection rate analytics"
+        months = response.json()["months"]
+        groups = {group["key"]: group for group in months[0]["groups"]} if months else {}
+        assert set(groups) == set(expected), f"{message}: properties differ from the payments"
+        for key, row in expected.items():
+            for field in ("expected", "collected", "payments"):
+                assert abs(groups[key][field] - row[field]) < 0.01, f"{message}: {field} of {key} differs from the payments"
+        response = requests.get(f"{API_URL}/analytics/revenue", params={"start": period, "end": period})
+        revenue = {group["key"]: group["revenue"] for group in response.json()["months"][0]["groups"]}
+        for key, row in expected.items():
+            assert abs(revenue.get(key, 0) - row["collected"]) < 0.01, f"{message}: revenue of {key} differs from the payments"
+    
+    headers = admin_headers()
+    response = requests.post(f"{API_URL}/jobs/period-close", headers=headers)
+    print_response(response, "POST /jobs/period-close:")
+    assert response.status_code == 200, "Failed to close periods"
+    check_analytics("Closed month")
+    
+    # Editing a payment of the closed month: served live until the month is closed again
+    pending = created_payments[1]
+    update = {key: pending[key] for key in ("tenant_id", "property_id", "unit_id", "month", "year", "due_date", "payment_method", "notes")}
+    response = requests.put(f"{API_URL}/payments/{pending['id']}", json={
+        **update, "amount": pending["amount"] + 100, "status": "payé", "paid_date": f"{period}-10"
+    })
+    print_response(response, f"PUT /payments/{pending['id']}:")
+    assert response.status_code == 200, "Failed to update payment"
+    check_analytics("Edited closed month")
+    
+    response = requests.post(f"{API_URL}/jobs/period-close", headers=headers)
+    assert response.status_code == 200, "Failed to close periods again"
+    check_analytics("Recomputed month")
+    
+    for payment in created_payments:
+        requests.delete(f"{API_URL}/payments/{payment['id']}")
+    
+    print("\n✅ Closed-month rollup tests passed successfully")
+
+def test_reports_api(tenants):
+    print_separator()
+    print("TESTING REPORTS API")
+    print_separator()
+    
+    response = requests.get(f"{API_URL}/reports/portfolio", params={"format": "csv"})
+    print(f"GET /reports/portfolio?format=csv: {response.status_code}, {len(response.content)} bytes")
+    assert response.status_code == 200, "Failed to export CSV report"
+    lines = response.text.strip().splitlines()
+    header = lines[0].split(",")
+    for column in ("tenant_id", "billed", "paid", "balance", "arrears", "occupancy_ratio"):
+        assert column in header, f"Report missing column {column}"
+    report_ids = {line.split(",")[0] for line in lines[1:]}
+    for tenant in tenants:
+        assert tenant["id"] in report_ids, "Tenant missing from report"
+    
+    response = requests.get(f"{API_URL}/reports/portfolio", params={"format": "csv", "level": "property"})
+    assert response.status_code == 200, "Failed to export property report"
+    assert response.text.startswith("property_id,"), "Property report has the wrong layout"
+    
+    response = requests.get(f"{API_URL}/reports/portfolio", params={"format": "xlsx"})
+    assert response.status_code == 200, "Failed to export XLSX report"
+    assert response.content[:2] == b"PK", "XLSX report is not a zip archive"
+    
+    response = requests.get(f"{API_URL}/reports/portfolio", params={"format": "parquet"})
+    assert response.status_code == 200, "Failed to export Parquet report"
+    assert response.content[:4] == b"PAR1", "Parquet report has no Parquet magic"
+    
+    response = requests.get(f"{API_URL}/reports/portfolio", params={"format": "pdf"})
+    assert response.status_code == 422, "Unknown format should be rejected"
+    
+    print("\n✅ Reports API tests passed successfully")
+
+def test_tenant_balance_api(tenants):
+    print_separator()
+    print("TESTING TENANT BALANCE API")
+    print_separator()
+    
+    for tenant in tenants:
+        response = requests.get(f"{API_URL}/tenants/{tenant['id']}/balance")
+        print_response(response, f"GET /tenants/{tenant['id']}/balance:")
+        assert response.status_code == 200, "Failed to get tenant balance"
+        balance = response.json()
+        
+        # The snapshot must match the tenant's payments and ledger
+        payments = requests.get(f"{API_URL}/payments/tenant/{tenant['id']}").json()
+        billed = sum(payment["amount"] for payment in payments)
+        collected = sum(payment["amount"] for payment in payments if payment["status"] == "payé")
+        assert abs(balance["debit"] - billed) < 0.01, "Balance debit does not match payments"
+        assert abs(balance["credit"] - collected) < 0.01, "Balance credit does not match payments"
+        assert abs(balance["balance"] - (billed - collected)) < 0.01, "Balance is not debit minus credit"
+        assert balance["months_paid"] == sum(1 for payment in payments if payment["status"] == "payé"), "Wrong months paid"
+        
+        tenant_data = requests.get(f"{API_URL}/tenants/{tenant['id']}").json()
+        assert tenant_data["months_paid"] == balance["months_paid"], "Tenant months_paid differs from its balance"
+        
+        response = requests.get(f"{API_URL}/tenants/{tenant['id']}/ledger")
+        assert response.status_code == 200, "Failed to get tenant ledger"
+        entries = response.json()
+        assert len(entries) == balance["entries"], "Ledger entry count differs from the snapshot"
+    
+    response = requests.get(f"{API_URL}/tenants/{uuid.uuid4()}/balance")
+    assert response.status_code == 404, "Unknown tenant should return 404"
+    
+    print("\n✅ Tenant balance API tests passed successfully")
+
+def test_field_selection_api():
+    print_separator()
+    print("TESTING FIELD SELECTION (?fields=)")
+    print_separator()
+    
+    for path, fields in (("tenants", ["name", "phone"]), ("payments", ["status", "amount"]), ("receipts", ["receipt_number", "amount"])):
+        full = requests.get(f"{API_URL}/{path}", params={"limit": 50})
+        response = requests.get(f"{API_URL}/{path}", params={"limit": 50, "fields": ",".join(fields)})
+        print(f"GET /{path}?fields={','.join(fields)}: {response.status_code}, {len(response.content)} bytes (full: {len(full.content)} bytes)")
+        assert response.status_code == 200, f"Field selection failed on /{path}"
+        items = response.json()
+        assert [item["id"] for item in items] == [item["id"] for item in full.json()], "Projection changed the page"
+        for item in items:
+            assert set(item) <= {"id", *fields}, f"Unrequested fields returned on /{path}: {set(item)}"
+        assert response.headers.get("x-next-cursor") == full.headers.get("x-next-cursor"), "Cursor lost with field selection"
+        
+        response = requests.get(f"{API_URL}/{path}", params={"fields": "id,not_a_field"})
+        assert response.status_code == 400, "Unknown field should be rejected"
+    
+    print("\n✅ Field selection tests passed successfully")
+
+def test_pagination_api():
+    print_separator()
+    print("TESTING CURSOR PAGINATION (X-Next-Cursor)")
+    print_separator()
+    
+    response = requests.get(f"{API_URL}/payments", params={"limit": 1000})
+    assert response.status_code == 200, "Failed to list payments"
+    assert "x-next-cursor" not in response.headers, "Test database too large for a single reference page"
+    expected = [payment["id"] for payment in response.json()]
+    assert len(expected) > 2, "Not enough payments to page through"
+    
+    # Small pages, following the cursor until the last page
+    page_size = 2
+    seen, created = [], []
+    params = {"limit": page_size}
+    while True:
+        response = requests.get(f"{API_URL}/payments", params=params)
+        assert response.status_code == 200, "Failed to get a page of payments"
+        page = response.json()
+        assert len(page) <= page_size, "Page larger than the limit"
+        seen += [payment["id"] for payment in page]
+        created += [datetime.fromisoformat(payment["created_at"]) for payment in page]
+        cursor = response.headers.get("x-next-cursor")
+        if not cursor:
+            break
+        assert len(page) == page_size, "Short page returned with a next cursor"
+        params = {"limit": page_size, "after": cursor}
+    print(f"Walked {len(seen)} payments in pages of {page_size}")
+    assert len(seen) == len(set(seen)), "A payment appeared on two pages"
+    assert seen == expected, "Paging skipped payments or changed their order"
+    assert created == sorted(created), "Pages are not in creation order"
+    
+    # A stream resumes from the same cursor
+    response = requests.get(f"{API_URL}/payments", params={"limit": page_size})
+    cursor = response.headers["x-next-cursor"]
+    response = requests.get(f"{API_URL}/payments", params={"stream": "true", "after": cursor})
+    assert response.status_code == 200, "Failed to stream payments from a cursor"
+    assert [payment["id"] for payment in response.json()] == expected[page_size:], "Stream did not resume after the cursor"
+    
+    for cursor in ("not-a-cursor", "bm90LWpzb24=", "WzFd"):
+        response = requests.get(f"{API_URL}/payments", params={"after": cursor})
+        print(f"GET /payments?after={cursor}: {response.status_code}")
+        assert response.status_code == 400, "Malformed cursor should be rejected"
+    
+    print("\n✅ Pagination tests passed successfully")
+
 def run_all_tests():
     try:
         print("\n🔍 Starting backend API tests...\n")
@@ -674,7 +1237,19 @@ def run_all_tests():
         test_dashboard_api()
         
         # Test the new receipts system
-        test_receipts_api(tenants, payments)
+        receipts = test_receipts_api(tenants, payments)
+        test_receipts_batch_api(payments, receipts[:-1])
+        test_mark_paid_api(tenants)
+        test_payment_schedule_api(tenants)
+        test_overdue_sweeper_api(tenants)
+        test_user_deactivation_api()
+        test_analytics_api(payments)
+        test_closed_month_rollups_api(tenants)
+        test_reports_api(tenants)
+        test_tenant_balance_api(tenants)
+        test_field_selection_api()
+        test_pagination_api()
+        test_backup_archive_api()
         
         print_separator()
         print("🎉 ALL BACKEND API TESTS PASSED SUCCESSFULLY! 🎉")
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+import asyncio
+import argparse
+import gzip
+import sys
+import time
+import zlib
+from datetime import datetime
+from pathlib import Path
+
+# Même format d'archive que /api/backup/archive : le code vient du serveur,
+# qui charge aussi backend/.env
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+import server
+
+async def export_backup(output: Path, incremental: bool, since: datetime = None):
+    if incremental and since is None:
+        since = await server.last_backup_watermark()
+        if since is None:
+            print("ℹ️  Aucune sauvegarde précédente - sauvegarde complète")
+    if not incremental:
+        since = None
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    partial = output.with_name(output.name + ".part")
+    started = time.perf_counter()
+    watermark = datetime.utcnow()
+
+    with open(partial, "wb") as archive:
+        async for chunk in server.archive_chunks(since=since, watermark=watermark):
+            archive.write(chunk)
+    partial.rename(output)
+
+    mode = "incremental" if since else "full"
+    await server.record_backup_run(mode, since, watermark, str(output.resolve()))
+
+    print("💾 SAUVEGARDE TERMINÉE !")
+    print(f"✅ Type: {'incrémentale depuis ' + since.isoformat() if since else 'complète'}")
+    print(f"✅ Fichier: {output}")
+    print(f"✅ Taille: {output.stat().st_size / 1024:.1f} Ko")
+    print(f"⏱️  Durée: {time.perf_counter() - started:.1f} s")
+
+def archive_chain(paths):
+    """Order archives by watermark and check that each incremental follows the previous one"""
+    headers = []
+    for path in paths:
+        with gzip.open(path, "rb") as archive:
+            header = server.read_archive_header(archive)
+        headers.append((header.get("watermark") or header["backup_date"], path, header))
+    headers.sort(key=lambda item: item[0])
+
+    chain = []
+    previous_watermark = None
+    for watermark, path, header in headers:
+        if header.get("mode") == "incremental":
+            if previous_watermark is None:
+                raise SystemExit(f"❌ {path}: sauvegarde incrémentale sans sauvegarde complète avant elle")
+            if header["since"] > previous_watermark:
+                raise SystemExit(f"❌ {path}: trou dans la chaîne (depuis {header['since']}, précédente {previous_watermark})")
+        chain.append(path)
+        previous_watermark = watermark
+    return chain
+
+async def restore_backup(paths):
+    started = time.perf_counter()
+    chain = archive_chain(paths)
+    for index, path in enumerate(chain):
+        try:
+            with gzip.open(path, "rb") as archive:
+                result = await server.restore_archive(archive)
+        except (EOFError, zlib.error) as e:
+            raise SystemExit(f"❌ {path}: archive illisible ({e})")
+
+        print(f"♻️  {path.name} ({'incrémentale' if result['mode'] == 'incremental' else 'complète'})")
+        print(f"Sauvegarde du: {result['backup_date']}")
+        if not result["complete"]:
+            print("⚠️  Archive incomplète (manifeste absent ou fichier tronqué) - restauration partielle")
+        for name, stats in result["collections"].items():
+            print(
+                f"  {name}: {stats['inserted']} insérés, {stats['updated']} mis à jour, "
+                f"{stats['skipped']} existants, {stats['invalid']} invalides, "
+                f"{stats['documents_per_second']} docs/s"
+            )
+        for name, count in result["deleted"].items():
+            print(f"  {name}: {count} supprimés")
+        if not result["complete"] and index < len(chain) - 1:
+            # The next incrementals assume this archive was restored in full
+            raise SystemExit(f"❌ Chaîne interrompue après {path.name}: {len(chain) - index - 1} archive(s) non restaurée(s)")
+
+    print("\n✅ RESTAURATION TERMINÉE !")
+    print(f"⏱️  Durée: {time.perf_counter() - started:.1f} s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Sauvegarde et restauration de la base (archives NDJSON gzip)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="Écrire une archive complète ou incrémentale")
+    export_parser.add_argument(
+        "-o", "--output",
+        type=Path,
+        default=Path("backups") / f"backup-{datetime.now().strftime('%Y%m%d-%H%M%S')}.ndjson.gz"
+    )
+    export_parser.add_argument(
+        "-i", "--incremental",
+        action="store_true",
+        help="Seulement les changements depuis la dernière sauvegarde"
+    )
+    export_parser.add_argument(
+        "--since",
+        type=datetime.fromisoformat,
+        help="Point de départ explicite (ISO 8601, UTC) pour --incremental"
+    )
+
+    restore_parser = commands.add_parser(
+        "restore",
+        help="Restaurer une archive ou une chaîne (complète + incrémentales)"
+    )
+    restore_parser.add_argument("archives", type=Path, nargs="+")
+
+    args = parser.parse_args()
+    try:
+        if args.command == "export":
+            asyncio.run(export_backup(args.output, args.incremental, args.since))
+        else:
+            asyncio.run(restore_backup(args.archives))
+    finally:
+        server.client.close()
+
+if __name__ == "__main__":
+    main()
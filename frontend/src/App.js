@@ -7,6 +7,29 @@ import './App.css';
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+// List endpoints are paginated: follow the X-Next-Cursor header until the last page.
+// `fields` restricts the columns returned by the API.
+const fetchAllPages = async (url, fields = null) => {
+  const items = [];
+  let after = null;
+  do {
+    const params = { limit: 1000 };
+    if (after) params.after = after;
+    if (fields) params.fields = fields.join(',');
+    const response = await axios.get(url, { params });
+    items.push(...response.data);
+    after = response.headers['x-next-cursor'];
+  } while (after);
+  return items;
+};
+
+// Columns used by the payments and receipts tables and the receipt view
+const PAYMENT_FIELDS = ['tenant_id', 'property_id', 'unit_id', 'month', 'year', 'amount', 'due_date', 'status', 'payment_method'];
+const RECEIPT_FIELDS = [
+  'receipt_number', 'tenant_id', 'tenant_name', 'property_name', 'amount', 'currency_symbol',
+  'period_month', 'period_year', 'payment_date', 'payment_method', 'notes', 'created_at'
+];
+
 // Auth Context
 const AuthContext = createContext();
 const useAuth = () => useContext(AuthContext);
@@ -197,8 +220,9 @@ function MainApp() {
   // Fetch receipts
   const fetchReceipts = async () => {
     try {
-      const response = await axios.get(`${API}/receipts`);
-      setReceipts(response.data);
+      const receipts = await fetchAllPages(`${API}/receipts`, RECEIPT_FIELDS);
+      receipts.sort((a, b) => (b.created_at || '').localeCompare(a.created_at || ''));
+      setReceipts(receipts);
     } catch (error) {
       console.error('Erreur lors de la récupération des reçus:', error);
     }
@@ -332,8 +356,7 @@ function MainApp() {
   // Fetch units
   const fetchUnits = async () => {
     try {
-      const response = await axios.get(`${API}/units`);
-      setUnits(response.data);
+      setUnits(await fetchAllPages(`${API}/units`));
     } catch (error) {
       console.error('Erreur lors de la récupération des unités:', error);
     }
@@ -342,8 +365,7 @@ function MainApp() {
   // Fetch properties
   const fetchProperties = async () => {
     try {
-      const response = await axios.get(`${API}/properties`);
-      setProperties(response.data);
+      setProperties(await fetchAllPages(`${API}/properties`));
     } catch (error) {
       console.error('Erreur lors de la récupération des propriétés:', error);
     }
@@ -352,8 +374,7 @@ function MainApp() {
   // Fetch tenants
   const fetchTenants = async () => {
     try {
-      const response = await axios.get(`${API}/tenants`);
-      setTenants(response.data);
+      setTenants(await fetchAllPages(`${API}/tenants`));
     } catch (error) {
       console.error('Erreur lors de la récupération des locataires:', error);
     }
@@ -362,8 +383,7 @@ function MainApp() {
   // Fetch payments
   const fetchPayments = async () => {
     try {
-      const response = await axios.get(`${API}/payments`);
-      setPayments(response.data);
+      setPayments(await fetchAllPages(`${API}/payments`, PAYMENT_FIELDS));
     } catch (error) {
       console.error('Erreur lors de la récupération des paiements:', error);
     }
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+import asyncio
+import argparse
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.uri_parser import parse_uri
+
+# Les handlers sont appelés directement, contre une base vue à travers un
+# proxy TCP qui retarde chaque paquet : la latence mesurée se lit en allers-retours
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+import server
+
+class DelayProxy:
+    """Forward TCP to Mongo, delaying every chunk by half the round-trip time in each direction"""
+
+    def __init__(self, host, port, delay_ms):
+        self.host = host
+        self.port = port
+        self.delay = delay_ms / 2000
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, client_reader, client_writer):
+        mongo_reader, mongo_writer = await asyncio.open_connection(self.host, self.port)
+        await asyncio.gather(
+            self.pipe(client_reader, mongo_writer),
+            self.pipe(mongo_reader, client_writer),
+            return_exceptions=True
+        )
+
+    async def pipe(self, reader, writer):
+        # Chunks keep their order: each one is released `delay` after it arrived
+        queue = asyncio.Queue()
+
+        async def release():
+            while True:
+                due, data = await queue.get()
+                await asyncio.sleep(max(0, due - time.monotonic()))
+                if not data:
+                    writer.close()
+                    return
+                writer.write(data)
+                await writer.drain()
+
+        releaser = asyncio.create_task(release())
+        try:
+            while True:
+                data = await reader.read(65536)
+                await queue.put((time.monotonic() + self.delay, data))
+                if not data:
+                    break
+            await releaser
+        finally:
+            releaser.cancel()
+
+DELETE_HANDLERS = [
+    ("receipts", server.delete_receipt),
+    ("payments", server.delete_payment),
+    ("tenants", server.delete_tenant),
+    ("units", server.delete_unit),
+    ("properties", server.delete_property),
+]
+
+async def benchmark(delay_ms, repeat):
+    proxy = None
+    direct_client = server.client
+    if delay_ms:
+        uri = parse_uri(server.mongo_url)
+        host, port = uri["nodelist"][0]
+        proxy = DelayProxy(host, port, delay_ms)
+        proxy_port = await proxy.start()
+        auth = {}
+        if uri["username"]:
+            auth = {"username": uri["username"], "password": uri["password"]}
+        server.client = AsyncIOMotorClient("127.0.0.1", proxy_port, directConnection=True, **auth)
+        server.db = server.client[os.environ["DB_NAME"]]
+
+    created = {name: [] for name, _ in DELETE_HANDLERS}
+    try:
+        server.settings_cache.set(await server.ensure_settings_document())
+        property_obj = await server.create_property(server.PropertyCreate(
+            address="Latency Bench Property",
+            monthly_rent=1000.0
+        ))
+        created["properties"].append(property_obj.id)
+
+        async def create_tenant(index):
+            unit = await server.create_unit(server.UnitCreate(
+                property_id=property_obj.id,
+                unit_number=f"Latency {index}",
+                unit_type="studio",
+                monthly_rent=500.0
+            ))
+            created["units"].append(unit.id)
+            started = time.perf_counter()
+            tenant = await server.create_tenant(server.TenantCreate(
+                name=f"Latency Tenant {index}",
+                phone="+33600000000",
+                property_id=property_obj.id,
+                unit_id=unit.id,
+                start_date="2024-01-01",
+                monthly_rent=500.0
+            ))
+            created["tenants"].append(tenant.id)
+            tenants.append(tenant)
+            return (time.perf_counter() - started) * 1000
+
+        async def create_receipt(index):
+            tenant = tenants[index % len(tenants)]
+            payment = await server.create_payment(server.PaymentCreate(
+                tenant_id=tenant.id,
+                property_id=property_obj.id,
+                unit_id=tenant.unit_id,
+                month=(index % 12) + 1,
+                year=2024,
+                amount=500.0,
+                due_date="2024-01-05",
+                status="payé"
+            ))
+            created["payments"].append(payment.id)
+            payments.append(payment)
+            started = time.perf_counter()
+            receipt = await server.create_receipt(server.ReceiptCreate(tenant_id=tenant.id, payment_id=payment.id))
+            created["receipts"].append(receipt.id)
+            return (time.perf_counter() - started) * 1000
+
+        async def update_property(index):
+            started = time.perf_counter()
+            await server.update_property(property_obj.id, server.PropertyCreate(
+                address="Latency Bench Property",
+                monthly_rent=1000.0 + index
+            ))
+            return (time.perf_counter() - started) * 1000
+
+        async def update_payment(index):
+            # A new amount on a paid payment: month counters and ledger entries move
+            payment = payments[index % len(payments)]
+            started = time.perf_counter()
+            await server.update_payment(payment.id, server.PaymentCreate(
+                **payment.dict(include=set(server.PaymentCreate.model_fields)) | {"amount": 500.0 + index}
+            ))
+            return (time.perf_counter() - started) * 1000
+
+        # Warm-up: connection pool, receipt counter seeding
+        tenants, payments = [], []
+        await create_tenant(0)
+        await create_receipt(0)
+
+        durations = {}
+        for name, handler in (
+            ("create_tenant", create_tenant),
+            ("create_receipt", create_receipt),
+            ("update_property", update_property),
+            ("update_payment", update_payment),
+        ):
+            durations[name] = [await handler(index) for index in range(1, repeat + 1)]
+        return durations
+    finally:
+        for name, delete in DELETE_HANDLERS:
+            for item_id in created[name]:
+                try:
+                    await delete(item_id)
+                except server.HTTPException:
+                    pass
+        if proxy:
+            server.client.close()
+            server.client = direct_client
+            server.db = direct_client[os.environ["DB_NAME"]]
+            await proxy.close()
+
+async def run(delays, repeat):
+    rows = []
+    for delay_ms in delays:
+        for name, durations in (await benchmark(delay_ms, repeat)).items():
+            median = statistics.median(durations)
+            round_trips = median / delay_ms if delay_ms else None
+            rows.append((delay_ms, name, median, round_trips))
+
+    print(f"{'délai ms':>10} | {'handler':>15} | {'médiane ms':>11} | {'allers-retours':>15}")
+    for delay_ms, name, median, round_trips in rows:
+        trips = f"{round_trips:.1f}" if round_trips is not None else "-"
+        print(f"{delay_ms:>10} | {name:>15} | {median:>11.1f} | {trips:>15}")
+
+    # Sequential lookups cost 7-8 round-trips per call, the gathered stages 3
+    worst = max((r[3] for r in rows if r[3] is not None), default=0)
+    if worst > 4.5:
+        print(f"\n❌ {worst:.1f} allers-retours par appel : les requêtes ne sont pas parallélisées")
+        return False
+    print("\n✅ Benchmark de latence terminé")
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description="Latence des handlers d'écriture (create_tenant, create_receipt, update_property, update_payment) avec un délai réseau injecté vers Mongo")
+    parser.add_argument("--delays", type=int, nargs="+", default=[0, 10, 50], help="Délais aller-retour en ms")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    try:
+        success = asyncio.run(run(args.delays, args.repeat))
+    finally:
+        server.client.close()
+    sys.exit(0 if success else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+import requests
+import uuid
+from datetime import datetime
+import sys
+import os
+from dotenv import load_dotenv
+import time
+import statistics
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Load environment variables from frontend/.env to get the backend URL
+load_dotenv("/app/frontend/.env")
+
+# Get the backend URL from environment variables
+BACKEND_URL = os.environ.get("REACT_APP_BACKEND_URL")
+if not BACKEND_URL:
+    print("Error: REACT_APP_BACKEND_URL not found in environment variables")
+    sys.exit(1)
+
+# Ensure the URL ends with /api
+API_URL = f"{BACKEND_URL}/api"
+print(f"Using API URL: {API_URL}")
+
+session = requests.Session()
+
+# Helper functions
+def print_separator():
+    print("\n" + "="*80 + "\n")
+
+def timed(method, url, repeat=10, **kwargs):
+    """Run the same request `repeat` times, return (median ms, p95 ms, last response)"""
+    durations = []
+    response = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        response = session.request(method, url, **kwargs)
+        durations.append((time.perf_counter() - started) * 1000)
+    return statistics.median(durations), percentile(durations, 0.95), response
+
+def percentile(durations, fraction):
+    durations = sorted(durations)
+    return durations[min(len(durations) - 1, int(len(durations) * fraction))]
+
+def print_timings(rows, headers):
+    print(" | ".join(f"{h:>14}" for h in headers))
+    for row in rows:
+        print(" | ".join(f"{v:>14.1f}" if isinstance(v, float) else f"{v:>14}" for v in row))
+
+def cleanup(created):
+    for path, ids in created.items():
+        for item_id in ids:
+            session.delete(f"{API_URL}/{path}/{item_id}")
+
+# Benchmarks
+def benchmark_occupancy_search():
+    print_separator()
+    print("BENCHMARK /search/occupancy (tenants joined with properties and units)")
+    print_separator()
+
+    created = {"tenants": [], "units": [], "properties": []}
+    rows = []
+    try:
+        response = session.post(f"{API_URL}/properties", json={
+            "address": f"Bench Property {uuid.uuid4().hex[:6]}",
+            "monthly_rent": 1000.0
+        })
+        assert response.status_code == 200, "Failed to create benchmark property"
+        property_id = response.json()["id"]
+        created["properties"].append(property_id)
+
+        search_date = datetime.now().strftime("%Y-%m-%d")
+        for target in (50, 200, 800):
+            while len(created["tenants"]) < target:
+                index = len(created["tenants"])
+                response = session.post(f"{API_URL}/units", json={
+                    "property_id": property_id,
+                    "unit_number": f"Bench {index}",
+                    "unit_type": "studio",
+                    "monthly_rent": 500.0
+                })
+                assert response.status_code == 200, "Failed to create benchmark unit"
+                unit_id = response.json()["id"]
+                created["units"].append(unit_id)
+
+                response = session.post(f"{API_URL}/tenants", json={
+                    "name": f"Bench Tenant {index}",
+                    "phone": "+33600000000",
+                    "property_id": property_id,
+                    "unit_id": unit_id,
+                    "start_date": "2020-01-01",
+                    "monthly_rent": 500.0
+                })
+                assert response.status_code == 200, "Failed to create benchmark tenant"
+                created["tenants"].append(response.json()["id"])
+
+            median, p95, response = timed("GET", f"{API_URL}/search/occupancy", params={"date": search_date})
+            assert response.status_code == 200, "Occupancy search failed"
+            occupants = len(response.json()["occupants"])
+            assert occupants >= target, f"Expected at least {target} occupants, got {occupants}"
+            rows.append((target, median, p95, median / target))
+
+        print_timings(rows, ["tenants", "median ms", "p95 ms", "ms/tenant"])
+
+        # With one round-trip per tenant the latency grows linearly with the
+        # tenant count; with the $lookup join only the payload size grows.
+        growth = rows[-1][1] / rows[0][1]
+        tenant_growth = rows[-1][0] / rows[0][0]
+        print(f"\nLatency x{growth:.1f} for x{tenant_growth:.0f} tenants")
+        assert growth < tenant_growth / 2, "Occupancy search latency grows with the tenant count"
+    finally:
+        cleanup(created)
+
+    print("\n✅ Occupancy search benchmark completed")
+
+def benchmark_login_storm():
+    print_separator()
+    print("BENCHMARK unrelated endpoint latency during a login storm")
+    print_separator()
+
+    # Logins for an existing user with a wrong password, so that every request
+    # goes through bcrypt verification. Each thread poses as its own client
+    # (X-Forwarded-For, honoured from TRUSTED_PROXIES addresses such as a local
+    # run) so that the per-IP limit does not turn the storm into 429s.
+    storm_threads = 32
+    username = os.environ.get("BENCH_USERNAME", "admin")
+    probe_url = f"{API_URL}/currencies"
+
+    def probe(count):
+        durations = []
+        with requests.Session() as probe_session:
+            for _ in range(count):
+                started = time.perf_counter()
+                response = probe_session.get(probe_url)
+                durations.append((time.perf_counter() - started) * 1000)
+                assert response.status_code == 200, "Probe endpoint failed"
+        return durations
+
+    baseline = probe(200)
+
+    stop = threading.Event()
+    login_statuses = {}
+    lock = threading.Lock()
+
+    def login_loop(index):
+        with requests.Session() as login_session:
+            login_session.headers["X-Forwarded-For"] = f"203.0.113.{index + 1}"
+            while not stop.is_set():
+                response = login_session.post(f"{API_URL}/auth/login", json={
+                    "username": username,
+                    "password": f"wrong-{uuid.uuid4().hex}"
+                })
+                with lock:
+                    login_statuses[response.status_code] = login_statuses.get(response.status_code, 0) + 1
+
+    with ThreadPoolExecutor(max_workers=storm_threads) as storm:
+        for index in range(storm_threads):
+            storm.submit(login_loop, index)
+        time.sleep(1)
+        during_storm = probe(200)
+        stop.set()
+
+    rows = [
+        ("baseline", statistics.median(baseline), percentile(baseline, 0.99)),
+        ("login storm", statistics.median(during_storm), percentile(during_storm, 0.99)),
+    ]
+    print_timings(rows, ["phase", "median ms", "p99 ms"])
+    print(f"\nLogin responses during the storm: {login_statuses}")
+
+    assert login_statuses.get(401, 0) > 0, f"No login reached password verification (does '{username}' exist?)"
+    assert login_statuses.get(429, 0) <= login_statuses.get(401, 0), (
+        "Most logins were refused by the per-IP limit: the storm did not load bcrypt "
+        "(run the benchmark from an address listed in TRUSTED_PROXIES)"
+    )
+    # With bcrypt on the event loop every probe waits behind ~250ms hashes
+    assert rows[1][2] < max(rows[0][2] * 5, 100), "Login storm stalls unrelated requests"
+
+    print("\n✅ Login storm benchmark completed")
+
+def benchmark_concurrent_updates():
+    print_separator()
+    print("BENCHMARK concurrent PUT /properties/{id} on the same document")
+    print_separator()
+
+    created = {"properties": []}
+    try:
+        response = session.post(f"{API_URL}/properties", json={
+            "address": "Bench Update 0",
+            "monthly_rent": 1000.0
+        })
+        assert response.status_code == 200, "Failed to create benchmark property"
+        property_id = response.json()["id"]
+        created["properties"].append(property_id)
+
+        def update(index):
+            with requests.Session() as writer:
+                started = time.perf_counter()
+                response = writer.put(f"{API_URL}/properties/{property_id}", json={
+                    "address": f"Bench Update {index}",
+                    "monthly_rent": 1000.0 + index
+                })
+                duration = (time.perf_counter() - started) * 1000
+            assert response.status_code == 200, "Property update failed"
+            body = response.json()
+            # Update and read are one atomic call: the response is exactly the
+            # write this request made, never one from a concurrent writer
+            consistent = body["address"] == f"Bench Update {index}" and body["monthly_rent"] == 1000.0 + index
+            return duration, consistent
+
+        rows = []
+        for writers in (1, 16, 64):
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=writers) as pool:
+                results = list(pool.map(update, range(writers * 10)))
+            elapsed = time.perf_counter() - started
+            durations = [duration for duration, _ in results]
+            mismatches = sum(1 for _, consistent in results if not consistent)
+            rows.append((writers, statistics.median(durations), percentile(durations, 0.99),
+                         len(results) / elapsed, mismatches))
+
+        print_timings(rows, ["writers", "median ms", "p99 ms", "updates/s", "mismatches"])
+        assert all(row[4] == 0 for row in rows), "An update returned another request's write"
+    finally:
+        cleanup(created)
+
+    print("\n✅ Concurrent update benchmark completed")
+
+def benchmark_field_selection():
+    print_separator()
+    print("BENCHMARK /receipts?fields= (projection) vs full documents")
+    print_separator()
+
+    fields = "receipt_number,tenant_name,amount,currency_symbol,period_month,period_year"
+    rows = []
+    for label, params in (("full", {"limit": 1000}), ("fields", {"limit": 1000, "fields": fields})):
+        median, p95, response = timed("GET", f"{API_URL}/receipts", params=params)
+        assert response.status_code == 200, "Receipts listing failed"
+        rows.append((label, len(response.json()), len(response.content), median, p95))
+
+    print_timings(rows, ["mode", "receipts", "bytes", "median ms", "p95 ms"])
+    if rows[0][1]:
+        print(f"\nPayload x{rows[1][2] / rows[0][2]:.2f}, latency x{rows[1][3] / rows[0][3]:.2f}")
+        assert rows[1][2] < rows[0][2], "Field selection does not shrink the payload"
+
+    print("\n✅ Field selection benchmark completed")
+
+def run_all_benchmarks():
+    try:
+        print("\n🔍 Starting backend performance benchmarks...\n")
+
+        benchmark_occupancy_search()
+        benchmark_login_storm()
+        benchmark_concurrent_updates()
+        benchmark_field_selection()
+
+        print_separator()
+        print("🎉 ALL BENCHMARKS COMPLETED! 🎉")
+        return True
+    except AssertionError as e:
+        print(f"\n❌ BENCHMARK FAILED: {str(e)}")
+        return False
+    except Exception as e:
+        print(f"\n❌ ERROR DURING BENCHMARK: {str(e)}")
+        return False
+
+if __name__ == "__main__":
+    # Wait a moment to ensure the backend is fully started
+    time.sleep(2)
+    success = run_all_benchmarks()